@@ -0,0 +1,115 @@
+"""
+Process wide caches of the small lookup tables replay imports resolve names
+against: Unit by map name and GameEventName by key.
+
+These barely ever change, so each worker process loads them once (see
+zcl.celery) and afterwards only goes to the database for names it hasn't
+seen. Names that don't exist yet are inserted together in one statement.
+Deleting or saving a row through the ORM clears the cache of that process
+(see api.signals) so that it is reloaded on the next miss.
+"""
+import logging
+import threading
+import typing
+
+from django.db import transaction
+
+from . import models
+
+log = logging.getLogger(__name__)
+
+
+class DimensionCache:
+    """
+    Name -> primary key of a lookup table.
+    Parameters
+    ----------
+    model: The Django model
+    field: The unique name field
+    defaults: Extra fields for new rows, given the name
+    """
+
+    def __init__(self, model, field: str, defaults: typing.Optional[typing.Callable[[str], dict]] = None):
+        self.model = model
+        self.field = field
+        self.defaults = defaults or (lambda name: {})
+        self._ids: typing.Dict[str, typing.Any] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def warm(self):
+        """Loads the whole table."""
+        ids = dict(self.model.objects.values_list(self.field, 'pk'))
+        with self._lock:
+            self._ids = ids
+        log.debug(f"Loaded {len(ids)} {self.model.__name__} rows")
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+
+    def _load(self, names: typing.Set[str]) -> typing.Dict[str, typing.Any]:
+        lookup = {f'{self.field}__in': names}
+        return dict(self.model.objects.filter(**lookup).values_list(self.field, 'pk'))
+
+    def _remember(self, ids: typing.Dict[str, typing.Any]):
+        def update():
+            with self._lock:
+                self._ids.update(ids)
+        # Rows read inside a transaction may be ones it created itself. Only
+        # keep them once they are sure to exist.
+        transaction.on_commit(update)
+
+    def resolve(self, names: typing.Iterable[str]) -> typing.Dict[str, typing.Any]:
+        """
+        Primary keys of every name, creating the rows that are missing.
+        Returns
+        -------
+        Dict[str, Any] of name -> primary key
+        """
+        names = set(names)
+        cached = self._ids
+        result = {name: cached[name] for name in names if name in cached}
+        missing = names - result.keys()
+        if not missing:
+            return result
+
+        # Another worker may have made them since we last looked
+        found = self._load(missing)
+        missing -= found.keys()
+        if missing:
+            self.model.objects.bulk_create(
+                [self.model(**{self.field: name}, **self.defaults(name)) for name in missing],
+                ignore_conflicts=True
+            )
+            found.update(self._load(missing))
+            log.info(f"New {self.model.__name__} rows {sorted(missing)}")
+        self._remember(found)
+        result.update(found)
+        return result
+
+    def get(self, name: str) -> typing.Any:
+        return self.resolve([name])[name]
+
+
+units = DimensionCache(models.Unit, 'map_name')
+game_event_names = DimensionCache(
+    models.GameEventName, 'id',
+    defaults=lambda key: {'title': f'New Game Event {key}'}
+)
+
+CACHES = (units, game_event_names)
+
+
+def warm():
+    for cache in CACHES:
+        cache.warm()
+
+
+def clear(model=None):
+    """Clears the caches of model, or every cache."""
+    for cache in CACHES:
+        if model is None or cache.model is model:
+            cache.clear()
@@ -0,0 +1,46 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def make_signature(profile_ids):
+    # Same as Team.make_signature at the time of this migration
+    return hashlib.sha1(','.join(sorted(set(profile_ids))).encode('utf-8')).hexdigest()
+
+
+def sign_teams(apps, schema_editor):
+    """
+    Signs every existing team, those without profiles included. Where several
+    teams have the same players only the oldest is signed, as that is the one
+    lookups used to find first.
+    """
+    Team = apps.get_model('api', 'Team')
+    members = {}
+    for team_id, profile_id in Team.profiles.through.objects.values_list('team_id', 'sc2profile_id'):
+        members.setdefault(team_id, []).append(profile_id)
+
+    seen = set()
+    to_update = []
+    for team_id in Team.objects.order_by('id').values_list('id', flat=True).iterator():
+        signature = make_signature(members.get(team_id, []))
+        if signature in seen:
+            continue
+        seen.add(signature)
+        to_update.append(Team(id=team_id, signature=signature))
+    Team.objects.bulk_update(to_update, ['signature'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0059_matchaggregates_profilealias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='signature',
+            field=models.CharField(max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(sign_teams, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 import typing
 
 import django.utils.timezone
@@ -428,6 +429,29 @@ class MatchLoser(WithTimeStamp):
 class Team(WithTimeStamp):
     name = models.CharField(max_length=300, default='')
     profiles = models.ManyToManyField(SC2Profile)
+    # make_signature() of the profiles. One team per set of players.
+    signature = models.CharField(max_length=40, unique=True, null=True)
+
+    @staticmethod
+    def make_signature(profile_ids: typing.Iterable[str]) -> str:
+        """sha1 of the sorted, distinct profile ids. The same for any order."""
+        return hashlib.sha1(','.join(sorted(set(profile_ids))).encode('utf-8')).hexdigest()
+
+    def update_signature(self) -> bool:
+        """
+        Signs the team again from its current profiles. If another team already
+        has these players it keeps the signature and this one is left unsigned.
+        Returns
+        -------
+        bool: False if the team was left unsigned because of such a duplicate
+        """
+        signature = self.make_signature(self.profiles.values_list('id', flat=True))
+        if signature == self.signature:
+            return True
+        signed = not Team.objects.filter(signature=signature).exclude(pk=self.pk).exists()
+        self.signature = signature if signed else None
+        Team.objects.filter(pk=self.pk).update(signature=self.signature)
+        return signed
 
     def __str__(self):
         """
@@ -1,11 +1,12 @@
 import logging
 
 from django.conf import settings
-from django.db.models.signals import pre_delete, post_delete, post_save
+from django.db.models.signals import pre_delete, post_delete, post_save, m2m_changed
 from django.dispatch.dispatcher import receiver
 
 from accounts.models import SocialAccount, DiscordUser
-from api.models import Replay, TwitchStream, SC2Profile, Match
+from api.models import Replay, TwitchStream, SC2Profile, Match, Unit, GameEventName, Team
+from api import dimensions
 from websub.models import Subscription
 from websub.signals import webhook_update
 from websub.views import WebSubView
@@ -39,6 +40,40 @@ def user_update(sender, instance, created, **kwargs):
     payload = DiscordUserSerializer(instance).data
     ws.send_notification(ws.types.USER_UPDATE, payload)
 
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+@receiver(post_save, sender=GameEventName)
+@receiver(post_delete, sender=GameEventName)
+def clear_dimension_cache(sender, **kwargs):
+    """
+    Rows changed in this process. Drop the cached ids so the next import
+    reloads them.
+    """
+    dimensions.clear(sender)
+
+@receiver(m2m_changed, sender=Team.profiles.through)
+def team_profiles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps Team.signature in step with the team's profiles however they are
+    changed, from either side of the relation.
+    """
+    if not reverse:
+        teams = [instance] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action == 'pre_clear':
+        # pk_set is None once they are gone. Remember which teams lost the profile.
+        instance._cleared_team_ids = list(instance.team_set.values_list('id', flat=True))
+        return
+    elif action in ('post_add', 'post_remove'):
+        teams = Team.objects.filter(id__in=pk_set)
+    elif action == 'post_clear':
+        teams = Team.objects.filter(id__in=getattr(instance, '_cleared_team_ids', []))
+    else:
+        return
+
+    for team in teams:
+        if not team.update_signature():
+            log.warning(f"Team {team.id} has the same players as another team. Left unsigned.")
+
 @receiver(post_save, sender=SC2Profile)
 def profile_get_details(sender, instance, created, **kwargs):
     """
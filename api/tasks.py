@@ -3,27 +3,31 @@ import typing
 import zclreplay
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from s2protocol import versions
 
 import ws
 import ws.types
 from . import annotations
-from . import models, utils, serializers
-from zclreplay.streamparser import StreamParser, StreamItem
+from . import models, utils, serializers, dimensions
+from zclreplay.streamparser import StreamParser
+from zclreplay import results
+from zclreplay.memory import trace_memory
 from django.db import transaction
+from django.conf import settings
 from zclreplay import objects as replayobjects
-from copy import copy
-import tracemalloc
+from zclreplay import utils as replayutils
 import services.blizzard
 from django.db.utils import IntegrityError
 
 log = get_task_logger('zcl.api.tasks')
 
+# Rows per INSERT statement for the bulk writes of a replay import
+BULK_BATCH_SIZE = 500
+
 
 def aggregate_match_stats(players):
     results = {}
     for p in players:
-        overview = p.unit_stats.overview
+        overview = p.overview
         for k in overview.keys():
             if k not in results.keys():
                 results[k] = {'created': 0, 'lost': 0, 'cancelled': 0}
@@ -41,7 +45,9 @@ def get_or_create_team(profiles: typing.List[models.SC2Profile]) -> models.Team:
     A team can have multiple players on it
     A player can be a member of multiple teams
     ---
-    However we want one team object for each unique set.
+    However we want one team object for each unique set. Each team is stored
+    with a signature of its players, so this is a single indexed lookup or
+    insert.
 
     Parameters
     ----------
@@ -51,52 +57,187 @@ def get_or_create_team(profiles: typing.List[models.SC2Profile]) -> models.Team:
     -------
     Team
     """
-    ids = [p.id for p in profiles]
-    teams: typing.List[models.Team] = (
-        models.Team
-        .objects
-        .prefetch_related('profiles')
-        .all()
-    )
-    for t in teams:
-        team_profiles = t.profiles.all()
-        if len(ids) == len(team_profiles):
-            if all(p.id in ids for p in team_profiles):
-                return t
-
-    team = models.Team()
-    team.save()
-    team.profiles.add(*profiles)
-    team.save()
+    signature = models.Team.make_signature(p.id for p in profiles)
+    team = models.Team.objects.filter(signature=signature).first()
+    if team is not None:
+        return team
+
+    try:
+        # A savepoint, so a lost race doesn't break the caller's transaction.
+        with transaction.atomic():
+            team = models.Team.objects.create(signature=signature)
+            team.profiles.add(*profiles)
+    except IntegrityError:
+        # Another worker made the same team first. The unique signature makes
+        # us wait for its commit, so it can be read now.
+        team = models.Team.objects.get(signature=signature)
     return team
 
+def record_replay(path: str, summary: bool = False, digest: typing.Optional[str] = None) -> results.ParseResult:
+    """
+    Parses a replay file into a ParseResult, falling back to the next higher
+    protocol if the first attempt fails.
+    Parameters
+    ----------
+    path: Local path of the replay
+    summary: Stop at the end of the game with only rosters and results
+    digest: content_hash of the file, if already known
+
+    Raises
+    ------
+    zclreplay.NotZCReplay, zclreplay.IncompleteReplay
+    """
+    try:
+        return _record(path, summary, digest)
+    except (zclreplay.NotZCReplay, zclreplay.IncompleteReplay):
+        raise
+    except:
+        # Some random error occurred. Sometimes this is due to missing protocol
+        # We already use the lower protocol if its not found. Try the higher.
+        log.error("Failed to Parse Game. Trying Higher Protocol Version.")
+        return _record(path, summary, digest, fallback=True)
+
+
+def _record(path: str, summary: bool, digest: typing.Optional[str], fallback: bool = False) -> results.ParseResult:
+    record = results.ParseResult.record_summary if summary else results.ParseResult.record
+    with StreamParser(path, streaming=settings.REPLAY_STREAMING, digest=digest) as replay:
+        if fallback:
+            replay.protocol = replay.fallback_protocol
+        if not settings.REPLAY_TRACE_MEMORY:
+            return record(replay)
+        with trace_memory(label=f"{path} {'summary' if summary else 'full'}"):
+            return record(replay)
+
+
 @shared_task
 def parse_replay(pk: int):
+    """
+    First phase of loading a replay. Only parses up to the end of the game and
+    saves the rosters and results, so the match shows as final right away.
+    Everything else is left to parse_replay_details, on its own lower
+    priority queue. See REPLAY_DETAILS_QUEUE.
+    """
     try:
         replay_model = models.Replay.objects.get(id=pk)
-        replay = StreamParser(replay_model.file)
-        do_parse(replay_model, replay)
-    except (zclreplay.NotZCReplay, zclreplay.IncompleteReplay) as e:
-        log.error(f"Error Not valid replay: {e}")
-        return
     except models.Replay.DoesNotExist:
         log.error(f"Cannot find Database Object with pk {pk}")
         return
-    except:
-        # Some random error occurred. Sometimes this is due to missing protocol
-        # We already use the lower protocol if its not found. Try the higher.
-        log.error("Failed to Parse Game. Trying Higher Protocol Version.")
+
+    # Parse from a memory mapped copy on local disk rather than holding the
+    # whole S3 object in memory.
+    with utils.local_replay_file(replay_model.file) as path:
+        result_cache = utils.get_result_cache()
+        digest = None
+        if result_cache is not None:
+            digest = results.content_hash(path)
+            result = results.cached_result(result_cache, digest, StreamParser.read_base_build(path))
+            if result is not None:
+                # Parsed before. Nothing left to defer.
+                log.info(f"{result.game_id} - Using cached parse result")
+                do_parse(replay_model, result)
+                return
+
+        try:
+            summary = record_replay(path, summary=True, digest=digest)
+        except (zclreplay.NotZCReplay, zclreplay.IncompleteReplay) as e:
+            log.error(f"Error Not valid replay: {e}")
+            return
+
+    # Profiles first, outside the transaction of import_summary
+    profile_cache = {}
+    utils.prefetch_profiles(summary.profile_ids(), profile_cache)
+    import_summary(replay_model, summary, profile_cache)
+    log.info(f"{summary.game_id} - Summary loaded. Queueing full stats.")
+    parse_replay_details.apply_async(kwargs={'pk': pk}, priority=settings.REPLAY_DETAILS_PRIORITY)
+
+
+@shared_task
+def parse_replay_details(pk: int):
+    """
+    Second phase of loading a replay. Parses it in full and loads the game
+    events, segments, unit stats, charts and messages for the match that
+    parse_replay already saved.
+
+    The replay is decoded again from the start. The stat handlers need every
+    event from the first loop on and the summary's parser state can't be
+    carried over to another worker, so there is nothing of the first phase to
+    resume from. The summary stops at the end of the game, before the end of
+    the streams, so it leaves nothing in the stream cache either. This pass
+    reads them to the end and fills it for any later reparse. The decode is
+    repeated, but on its own queue and after the results are already
+    showing.
+    """
+    try:
         replay_model = models.Replay.objects.get(id=pk)
-        replay = StreamParser(replay_model.file)
-        replay.protocol = versions.build(replay.fallback_versions[1])
-        do_parse(replay_model, replay)
+    except models.Replay.DoesNotExist:
+        log.error(f"Cannot find Database Object with pk {pk}")
+        return
 
+    with utils.local_replay_file(replay_model.file) as path:
+        result_cache = utils.get_result_cache()
+        digest, result = None, None
+        if result_cache is not None:
+            digest = results.content_hash(path)
+            result = results.cached_result(result_cache, digest, StreamParser.read_base_build(path))
 
-@transaction.atomic()
-def do_parse(replay_model, replay: StreamParser):
+        if result is None:
+            try:
+                result = record_replay(path, digest=digest)
+            except (zclreplay.NotZCReplay, zclreplay.IncompleteReplay) as e:
+                log.error(f"Error Not valid replay: {e}")
+                return
+            if result_cache is not None:
+                results.store_result(result_cache, digest, result)
+
+    try:
+        match = models.Match.objects.get(id=result.game_id)
+    except models.Match.DoesNotExist:
+        log.error(f"{result.game_id} - No match to add details to. Loading in full.")
+        do_parse(replay_model, result)
+        return
     profile_cache = {}
-    match_team_container = {}
+    utils.prefetch_profiles(result.profile_ids(), profile_cache)
+    import_details(match, result, profile_cache)
+
+
+def do_parse(replay_model, replay: results.ParseResult):
+    """
+    Loads a full parse result in stages, so that the transaction holding the
+    match rows only covers the database writes:
 
+    1. Profiles are created up front. They stand on their own.
+    2. Every match row is deleted and written again in one short transaction.
+    3. Once that has committed, the charts are uploaded to S3 together. They
+       are built beforehand, and nothing is uploaded for a transaction that
+       rolls back.
+
+    Every stage can be run again. If any fails the task can simply be rerun,
+    and a cached parse result makes that cheap.
+    """
+    profile_cache = {}
+    utils.prefetch_profiles(replay.profile_ids(), profile_cache)
+    charts = build_charts(replay)
+    with transaction.atomic():
+        match = import_summary(replay_model, replay, profile_cache)
+        save_details(match, replay, profile_cache)
+        transaction.on_commit(lambda: utils.upload_charts(charts, match_id=replay.game_id))
+
+
+@transaction.atomic()
+def import_summary(replay_model, replay: results.ParseResult, profile_cache: dict) -> models.Match:
+    """
+    Saves the match, teams, rosters, winners and losers and marks the match
+    final. Only needs the players and teams of the result, so a summary will
+    do.
+    Parameters
+    ----------
+    profile_cache: Filled by utils.prefetch_profiles for the result
+
+    Returns
+    -------
+    models.Match
+    """
+    match_team_container = {}
 
     game_id = replay.game_id
 
@@ -113,162 +254,51 @@ def do_parse(replay_model, replay: StreamParser):
     match.status = 'final'
     match.save()
     if not match_created:
-        # Re-parse. Clear out any match events or anything that could have different lengths
-        match.game_events.all().delete()
+        # Re-parse. Clear out anything that could have different lengths
         match.teams.all().delete()
         match.rosters.all().delete()
-        match.segments.all().delete()
-        match.unit_stats.all().delete()
         match.match_winners.all().delete()
         match.matchteam_set.all().delete()
         match.match_losers.all().delete()
-        match.messages.all().delete()
-
-
-    # Create team objects
-
-
-    upgrade_key_set = set()
-    time_series = []
-    unit_upgrades = []
-    for stream_item in replay._parse():
-        stream_item:StreamItem
-        payload = stream_item.payload
-        state:StreamParser = stream_item.state
-        event:replayobjects.Event = stream_item.event
-
-        if isinstance(payload, replayobjects.MatchEvent):
-            game_event_name, created = models.GameEventName.objects.get_or_create(
-                id=payload.key,
-                defaults={'title': f'New Game Event {payload.key}'}
-            )
-
-            ge_profile = utils.fetch_or_create_profile(payload.profile, profile_cache)
-            ge_opposing_profile = utils.fetch_or_create_profile(payload.opposing_profile, profile_cache)
-
-            game_event, updated = models.GameEvent.objects.update_or_create(
-                key=game_event_name,
-                match=match,
-                profile=ge_profile,
-                opposing_profile=ge_opposing_profile,
-                game_time=payload.game_time,
-                defaults={
-                    'game_time': payload.game_time,
-                    'value': payload.value,
-                    'description': payload.description,
-                    'total_score': payload.profile.unit_stats.total_score,
-                    'minerals_on_hand': payload.profile.unit_stats.minerals_on_hand,
-                }
-            )
-            # Generate the information for the Total Score and Minerals Floating
-            # Charts here. We'll upload them to S3 down below.
-            on_hand = lambda o: o.get('created', 0) - o.get('lost', 0) - o.get('cancelled', 0)
-            for event_player_state in state.players:
-                payload = {
-                    'id': event_player_state.profile_id,
-                    'name': event_player_state.name,
-                    'game_time': event.game_time,
-                    'total_score': event_player_state.unit_stats.total_score,
-                    'minerals_floated': event_player_state.unit_stats.minerals_on_hand,
-                    'bunkers': on_hand(event_player_state.unit_stats.bunkers),
-                    'tanks': on_hand(event_player_state.unit_stats.tanks),
-                    'depots': on_hand(event_player_state.unit_stats.depots),
-                    'nukes': on_hand(event_player_state.unit_stats.nukes),
-                    'current_supply': on_hand(event_player_state.unit_stats.biological_stats)
-
-                }
-                time_series.append(payload)
-
-        if isinstance(payload, replayobjects.SegmentEvent):
-            segment, created = models.Segment.objects.update_or_create(
-                measure=payload.key,
-                match=match,
-                defaults={
-                    'game_time': event.game_time,
-                    'valid': payload.valid,
-                }
-            )
-
-            for p in state.players:
-                segment_profile = utils.fetch_or_create_profile(p, profile_cache)
-                segment_lane = utils.fetch_or_create_profile(p.lane, profile_cache)
-                segment_killer = utils.fetch_or_create_profile(p.killer, profile_cache)
-                profile_item, created = models.SegmentProfileItem.objects.update_or_create(
-                    segment=segment,
-                    match=match,
-                    profile=segment_profile,
-                    defaults={
-                        'lane': segment_lane,
-                        'left_game': p.left_game,
-                        'eliminated': p.eliminated,
-                        'eliminated_by': segment_killer,
-                        'total_score': p.unit_stats.total_score,
-                        'minerals_on_hand': p.unit_stats.minerals_on_hand,
-                        'army_value': p.unit_stats.army_value,
-                        'tech_value': p.unit_stats.tech_value,
-                        'lost_tech_value': p.unit_stats.lost_tech_value,
-                        'tech_damage_value': p.unit_stats.tech_damage_value
-                    }
-                )
-                for u in p.unit_stats.overview.keys():
-                    # Just grab this current player stats and commit that
-                    # to the database. No vs data.
-                    unit, _ = models.Unit.objects.get_or_create(
-                        map_name=u
-                    )
-                    models.SegmentUnitStat.objects.update_or_create(
-                        segment_profile=profile_item,
-                        segment=segment,
-                        unit=unit,
-                        created=p.unit_stats.overview.get(u, {}).get('created', 0),
-                        killed=p.unit_stats.overview.get(u, {}).get('killed', 0),
-                        lost=p.unit_stats.overview.get(u, {}).get('lost', 0),
-                        cancelled=p.unit_stats.overview.get(u, {}).get('cancelled', 0)
-                    )
-
-
-
-
-        if isinstance(payload, replayobjects.UpgradeEvent):
-            container = []
-            for player_unit_upgrades in state.players:
-                ups = copy(player_unit_upgrades.upgrade_totals)
-                ups['profile_id'] = player_unit_upgrades.profile_id
-                ups['name'] = player_unit_upgrades.name
-                ups['game_time'] = event.game_time
-                ups['total_score'] = player_unit_upgrades.unit_stats.total_score
-                upgrade_key_set.update(ups.keys())
-                container.append(ups)
-            unit_upgrades.append(container)
-
 
+    # Rows are collected keyed by what update_or_create used to look them up
+    # by, so a repeat replaces the earlier row just as it would have, and are
+    # then written with one bulk_create per table. Anything from an earlier
+    # parse was deleted above.
+    match_teams = {}
     for t in replay.teams:
-        if len(t.players) == 0:
+        if len(t.profile_ids) == 0:
             continue
         # convert to database instances
-        profiles_db = [utils.fetch_or_create_profile(pt, profile_cache) for pt in t.players]
+        profiles_db = [utils.fetch_or_create_profile(pt, profile_cache) for pt in t.profile_ids]
         team_db = get_or_create_team(profiles_db)
         if match.draw:
             outcome = 'draw'
         else:
             outcome = 'win' if t.winner else 'loss'
 
-        match_team, _ = models.MatchTeam.objects.update_or_create(
-            match=match,
-            team=team_db,
-            position=t.position,
-            outcome=outcome,
-        )
+        key = (team_db.id, t.position, outcome)
+        match_team = match_teams.get(key)
+        if match_team is None:
+            match_team = match_teams[key] = models.MatchTeam(
+                match=match,
+                team=team_db,
+                position=t.position,
+                outcome=outcome,
+            )
         match_team_container[t.id] = match_team
+    models.MatchTeam.objects.bulk_create(match_teams.values())
+
+    rosters, winners, losers = {}, {}, {}
 
     # Get Roster information loaded
     for p in replay.players:
-        p: zclreplay.Player
+        p: zclreplay.PlayerState
         # Get player profile:
-        team = match_team_container[p.team.id]
+        team = match_team_container[p.team_id]
         profile = utils.fetch_or_create_profile(p, profile_cache)
-        lane_profile = utils.fetch_or_create_profile(p.lane, profile_cache)
-        killer = utils.fetch_or_create_profile(p.killer, profile_cache)
+        lane_profile = utils.fetch_or_create_profile(p.lane_id, profile_cache)
+        killer = utils.fetch_or_create_profile(p.killer_id, profile_cache)
 
         if p.name != profile.name:
             # Track the name change
@@ -289,47 +319,36 @@ def do_parse(replay_model, replay: StreamParser):
             except models.ProfileAlias.MultipleObjectsReturned:
                 log.debug(f'Multiple Aliases returned for {profile.name}. Ignoring')
 
-        models.Roster.objects.update_or_create(
+        rosters[profile.id] = models.Roster(
             match=match,
             sc2_profile=profile,
-            defaults={
-                'color': p.color_string,
-                'lane': lane_profile,
-                'team_number': p.team.id,
-                'position_number': p.position,
-                'team': team,
-            }
+            color=p.color_string,
+            lane=lane_profile,
+            team_number=p.team_id,
+            position_number=p.position,
+            team=team,
         )
         if p.winner:
-            models.MatchWinner.objects.update_or_create(
+            winners[profile.id] = models.MatchWinner(
                 match=match,
                 profile=profile,
-                defaults = {
-                    'carried': p.eliminated
-                }
+                carried=p.eliminated
             )
         else:
-            models.MatchLoser.objects.update_or_create(
+            losers[profile.id] = models.MatchLoser(
                 match=match,
                 profile=profile,
-                defaults={
-                    'killer': killer,
-                    'left_game': p.left_game,
-                    'game_time': float(p.eliminated_at),
-                    'victim_number': p.victim_number
-                }
+                killer=killer,
+                left_game=p.left_game,
+                game_time=replayutils.gameloop_to_seconds(p.eliminated_at_loop),
+                victim_number=p.victim_number
             )
 
+    models.Roster.objects.bulk_create(rosters.values())
+    models.MatchWinner.objects.bulk_create(winners.values())
+    models.MatchLoser.objects.bulk_create(losers.values())
 
-
-    for upgrade_iteration in unit_upgrades:
-        for player_upgrades in upgrade_iteration:
-            for k in upgrade_key_set:
-                if k not in player_upgrades.keys():
-                    player_upgrades[k] = 0
-
-
-    match.game_length = replay.stream_game_length
+    match.game_length = replayutils.gameloop_to_seconds(replay.game_loop)
     match.save()
     try:
         if match_created:
@@ -338,12 +357,198 @@ def do_parse(replay_model, replay: StreamParser):
             replay_model.match = match
             replay_model.save()
     except IntegrityError:
-        print(f"Integrity error on {game_id}")
-        print(f"replay.match is")
-        print(replay_model.match)
-        print('match is')
-        print(match)
-        print(f'Match created: {match_created}')
+        log.exception(f"{game_id} - Integrity error linking replay {replay_model.id} to the new match")
+        raise
+
+    return match
+
+
+def import_details(match: models.Match, replay: results.ParseResult, profile_cache: dict):
+    """
+    Loads the charts, game events, segments and unit stats, aggregates and
+    messages of a fully parsed replay for a match saved by import_summary.
+    See do_parse for the stages.
+    Parameters
+    ----------
+    profile_cache: Filled by utils.prefetch_profiles for the result
+    """
+    charts = build_charts(replay)
+    with transaction.atomic():
+        save_details(match, replay, profile_cache)
+        transaction.on_commit(lambda: utils.upload_charts(charts, match_id=replay.game_id))
+
+
+def build_charts(replay: results.ParseResult) -> typing.Dict[str, typing.Any]:
+    """The chart data of a full parse result by chart name, ready for S3."""
+    upgrade_key_set = set()
+    time_series = []
+    unit_upgrades = []
+    on_hand = lambda o: o.get('created', 0) - o.get('lost', 0) - o.get('cancelled', 0)
+    for stream_item in replay.items:
+        stream_item: results.RecordedItem
+        payload = stream_item.payload
+        game_time = stream_item.game_time
+
+        if isinstance(payload, replayobjects.MatchEvent):
+            # Total Score and Minerals Floating charts
+            for event_player_state in stream_item.players:
+                time_series.append({
+                    'id': event_player_state.profile_id,
+                    'name': event_player_state.name,
+                    'game_time': game_time,
+                    'total_score': event_player_state.total_score,
+                    'minerals_floated': event_player_state.minerals_on_hand,
+                    'bunkers': on_hand(event_player_state.bunkers),
+                    'tanks': on_hand(event_player_state.tanks),
+                    'depots': on_hand(event_player_state.depots),
+                    'nukes': on_hand(event_player_state.nukes),
+                    'current_supply': on_hand(event_player_state.biological_stats)
+                })
+
+        if isinstance(payload, replayobjects.UpgradeEvent):
+            container = []
+            for player_unit_upgrades in stream_item.players:
+                ups = dict(player_unit_upgrades.upgrade_totals)
+                ups['profile_id'] = player_unit_upgrades.profile_id
+                ups['name'] = player_unit_upgrades.name
+                ups['game_time'] = game_time
+                ups['total_score'] = player_unit_upgrades.total_score
+                upgrade_key_set.update(ups.keys())
+                container.append(ups)
+            unit_upgrades.append(container)
+
+    for upgrade_iteration in unit_upgrades:
+        for player_upgrades in upgrade_iteration:
+            for k in upgrade_key_set:
+                if k not in player_upgrades.keys():
+                    player_upgrades[k] = 0
+
+    return {
+        'upgrades': unit_upgrades,
+        'feed': [replay.feeds[p.profile_id] for p in replay.players],
+        'time_series': time_series,
+        'unit_stats': replay.unit_stats,
+    }
+
+
+@transaction.atomic()
+def save_details(match: models.Match, replay: results.ParseResult, profile_cache: dict):
+    """
+    Replaces the game events, segments and unit stats, aggregates and
+    messages of the match with those of the parse result, in one
+    transaction. The profiles must already be in profile_cache.
+    """
+    # Clear out anything left from an earlier parse. These can have different
+    # lengths.
+    match.game_events.all().delete()
+    match.segments.all().delete()
+    match.unit_stats.all().delete()
+    match.messages.all().delete()
+
+    # Rows keyed by their old update_or_create lookups. See import_summary.
+    game_events = {}
+    segments = {}
+    segment_profiles = {}
+    # (measure, profile id) -> {(unit name, created, killed, lost, cancelled)}
+    segment_unit_stats = {}
+    for stream_item in replay.items:
+        stream_item: results.RecordedItem
+        payload = stream_item.payload
+        game_time = stream_item.game_time
+
+        if isinstance(payload, replayobjects.MatchEvent):
+            ge_profile = utils.fetch_or_create_profile(payload.profile, profile_cache)
+            ge_opposing_profile = utils.fetch_or_create_profile(payload.opposing_profile, profile_cache)
+
+            key = (
+                payload.key,
+                ge_profile and ge_profile.id,
+                ge_opposing_profile and ge_opposing_profile.id,
+                payload.game_time,
+            )
+            # GameEventName is keyed by the event key itself. Missing ones
+            # are created below.
+            game_events[key] = models.GameEvent(
+                key_id=payload.key,
+                match=match,
+                profile=ge_profile,
+                opposing_profile=ge_opposing_profile,
+                game_time=payload.game_time,
+                value=payload.value,
+                description=payload.description,
+                total_score=payload.total_score,
+                minerals_on_hand=payload.minerals_on_hand,
+            )
+        if isinstance(payload, replayobjects.SegmentEvent):
+            # The segment gets its id when written, so its rows are linked up
+            # then.
+            segments[payload.key] = {
+                'game_time': game_time,
+                'valid': payload.valid,
+            }
+
+            for p in stream_item.players:
+                segment_profile = utils.fetch_or_create_profile(p, profile_cache)
+                segment_lane = utils.fetch_or_create_profile(p.lane_id, profile_cache)
+                segment_killer = utils.fetch_or_create_profile(p.killer_id, profile_cache)
+                key = (payload.key, segment_profile.id)
+                segment_profiles[key] = {
+                    'profile': segment_profile,
+                    'lane': segment_lane,
+                    'left_game': p.left_game,
+                    'eliminated': p.eliminated,
+                    'eliminated_by': segment_killer,
+                    'total_score': p.total_score,
+                    'minerals_on_hand': p.minerals_on_hand,
+                    'army_value': p.army_value,
+                    'tech_value': p.tech_value,
+                    'lost_tech_value': p.lost_tech_value,
+                    'tech_damage_value': p.tech_damage_value
+                }
+                unit_stats = segment_unit_stats.setdefault(key, set())
+                for u, counts in p.overview.items():
+                    # Just grab this current player stats and commit that
+                    # to the database. No vs data.
+                    unit_stats.add((
+                        u,
+                        counts.get('created', 0),
+                        counts.get('killed', 0),
+                        counts.get('lost', 0),
+                        counts.get('cancelled', 0),
+                    ))
+
+
+
+
+    dimensions.game_event_names.resolve(key[0] for key in game_events)
+    models.GameEvent.objects.bulk_create(game_events.values(), batch_size=BULK_BATCH_SIZE)
+    segments_db = {
+        measure: models.Segment(measure=measure, match=match, **fields)
+        for measure, fields in segments.items()
+    }
+    models.Segment.objects.bulk_create(segments_db.values())
+    segment_profiles_db = {
+        key: models.SegmentProfileItem(segment=segments_db[key[0]], match=match, **fields)
+        for key, fields in segment_profiles.items()
+    }
+    models.SegmentProfileItem.objects.bulk_create(segment_profiles_db.values(), batch_size=BULK_BATCH_SIZE)
+    unit_ids = dimensions.units.resolve(
+        stat[0] for unit_stats in segment_unit_stats.values() for stat in unit_stats
+    )
+    models.SegmentUnitStat.objects.bulk_create((
+        models.SegmentUnitStat(
+            segment_profile=segment_profiles_db[key],
+            segment=segments_db[key[0]],
+            unit_id=unit_ids[u],
+            created=created,
+            killed=killed,
+            lost=lost,
+            cancelled=cancelled,
+        )
+        for key, unit_stats in segment_unit_stats.items()
+        for u, created, killed, lost, cancelled in unit_stats
+    ), batch_size=BULK_BATCH_SIZE)
+
 
     # Get match aggregates
     match_aggregates = aggregate_match_stats(replay.players)
@@ -364,25 +569,28 @@ def do_parse(replay_model, replay: StreamParser):
         }
     )
 
-    utils.gzip_chart_to_s3(unit_upgrades, match_id=replay.game_id, name='upgrades')
-    feed = [p.feed for p in replay.players]
-    utils.gzip_chart_to_s3(feed, match_id=replay.game_id, name='feed')
-    utils.gzip_chart_to_s3(time_series, match_id=replay.game_id, name='time_series')
-    utils.gzip_chart_to_s3(replay.unit_stats(), match_id=replay.game_id, name='unit_stats')
-
-    for replay_msg in replay.messages:
-        msg_owner = utils.fetch_or_create_profile(replay_msg.profile, profile_cache)
-        models.MatchMessage.objects.create(
+    models.MatchMessage.objects.bulk_create((
+        models.MatchMessage(
             match=match,
-            profile=msg_owner,
+            profile=utils.fetch_or_create_profile(replay_msg.profile, profile_cache),
             message_type=replay_msg.message_type,
             message=replay_msg.message,
             game_time=replay_msg.game_time,
         )
+        for replay_msg in replay.messages
+    ), batch_size=BULK_BATCH_SIZE)
 
     log.info(f"{replay.game_id} - Loaded to Database")
 
 
+@shared_task
+def get_profiles_details(ids: typing.List[str], ignore_missing=False):
+    """get_profile_details for a batch of profiles, like the new ones of a replay."""
+    api = services.blizzard.BlizzardAPI()
+    for id in ids:
+        get_profile_details(id, api_class=api, ignore_missing=ignore_missing)
+
+
 @shared_task
 def get_profile_details(id: str, api_class=None, ignore_missing=False):
     try:
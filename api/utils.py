@@ -2,13 +2,18 @@ import gzip
 import io
 import json
 import re
+import tempfile
 import typing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import boto3
 import requests
 import zclreplay
+from zclreplay import results
 from django.conf import settings
 from typing import Iterator, TypeVar, Generic
+from django.db import transaction
 from django.db.models import QuerySet
 
 from .models import SC2Profile
@@ -38,16 +43,41 @@ def get_player_name(profile: SC2Profile) -> str:
         return "Unknown"
     return name
 
-def gzip_chart_to_s3(obj: typing.Any, match_id: int, name: str, bucket: str = 'zcleagues'):
+def s3_client():
+    return boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+
+def gzip_chart_to_s3(obj: typing.Any, match_id: int, name: str, bucket: str = 'zcleagues', s3=None):
     key = 'charts/{0}/{0}_{1}.json.gz'.format(match_id, name)
-    s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                      aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+    if s3 is None:
+        s3 = s3_client()
     tmp = io.BytesIO()
     with gzip.GzipFile(fileobj=tmp, mode='wb') as fout:
         fout.write(json.dumps(obj).encode('utf-8'))
     tmp.seek(0)
     s3.upload_fileobj(tmp, bucket, key)
 
+def upload_charts(charts: typing.Dict[str, typing.Any], match_id: int, bucket: str = 'zcleagues'):
+    """
+    gzip_chart_to_s3 for every chart at once, each on its own thread. Waits
+    for all of them and raises the first error, if any.
+    Parameters
+    ----------
+    charts: Chart name -> data
+    """
+    if not charts:
+        return
+    # Clients are thread safe, but making them at the same time from threads
+    # is not.
+    s3 = s3_client()
+    with ThreadPoolExecutor(max_workers=len(charts)) as executor:
+        futures = [
+            executor.submit(gzip_chart_to_s3, obj, match_id=match_id, name=name, bucket=bucket, s3=s3)
+            for name, obj in charts.items()
+        ]
+    for future in futures:
+        future.result()
+
 def get_chart_from_s3(match_id: int, name: str, bucket: str = 'zcleagues'):
     key = 'charts/{0}/{0}_{1}.json.gz'.format(match_id, name)
     s3 = boto3.client('s3',
@@ -61,7 +91,86 @@ def get_chart_from_s3(match_id: int, name: str, bucket: str = 'zcleagues'):
     return data
 
 
-def fetch_or_create_profile(profile: typing.Union[str, zclreplay.Player], cache: typing.Dict[str, typing.Any] = {}) -> typing.Optional[SC2Profile]:
+@contextmanager
+def local_replay_file(field_file) -> typing.Iterator[str]:
+    """
+    A local path for a stored replay file that zclreplay can memory map.
+    Replays on remote storage are copied to a temporary file on disk chunk by
+    chunk rather than buffered in memory, and the file is removed afterwards.
+    Parameters
+    ----------
+    field_file: The FieldFile of a models.Replay
+
+    Returns
+    -------
+    Context manager yielding the path
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        # Remote storage
+        path = None
+    if path is not None:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.SC2Replay') as tmp:
+        field_file.open('rb')
+        try:
+            for chunk in field_file.chunks():
+                tmp.write(chunk)
+        finally:
+            field_file.close()
+        tmp.flush()
+        yield tmp.name
+
+
+class DjangoResultCache:
+    """
+    Keeps zclreplay ParseResults in one of the Django caches so every worker
+    shares them. Age is bounded by the timeout, size by the backend's own
+    culling.
+    """
+    def __init__(self, alias: str = 'default', timeout: typing.Optional[int] = None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, result):
+        self.cache.set(key, result, timeout=self.timeout)
+
+    def delete(self, key: str):
+        self.cache.delete(key)
+
+
+def get_result_cache():
+    """
+    The parse result cache set up by settings.REPLAY_RESULT_CACHE, or None
+    if caching is turned off.
+    """
+    backend = settings.REPLAY_RESULT_CACHE
+    if backend == 'file':
+        return results.FileResultCache(
+            settings.REPLAY_RESULT_CACHE_DIR,
+            max_bytes=settings.REPLAY_RESULT_CACHE_MAX_BYTES,
+            max_age=settings.REPLAY_RESULT_CACHE_MAX_AGE,
+        )
+    if backend == 'django':
+        return DjangoResultCache(
+            settings.REPLAY_RESULT_CACHE_ALIAS,
+            timeout=settings.REPLAY_RESULT_CACHE_MAX_AGE,
+        )
+    return None
+
+
+def fetch_or_create_profile(profile: typing.Union[str, zclreplay.Player, zclreplay.PlayerState], cache: typing.Optional[typing.Dict[str, typing.Any]] = None) -> typing.Optional[SC2Profile]:
     """
     Commonly we need to fetch profiles from the replay parser. This helps optimize it by storing the results of a
     query in a cache that the caller passes in. Python passes in dicts by reference so this will mutate from the caller.
@@ -69,20 +178,23 @@ def fetch_or_create_profile(profile: typing.Union[str, zclreplay.Player], cache:
     If no profile is found, we create it and update the cache with the new instance.
     Parameters
     ----------
-    profile: either the profile string, or a replay Player instance
-    cache: A dict container that is indexed by profile_id and has the resulting SC2Profile object
+    profile: either the profile string, or a replay Player/PlayerState instance
+    cache: A dict container that is indexed by profile_id and has the resulting SC2Profile object. Without one
+        nothing is cached between calls.
 
     Returns
     -------
     Optional[SC2Profile]. This will return None if the profile attribute is None
     """
-    from api.tasks import get_profile_details
     profile_id = profile # Default to string
 
     if profile_id is None:
         return
 
-    if isinstance(profile, zclreplay.Player):
+    if cache is None:
+        cache = {}
+
+    if isinstance(profile, (zclreplay.Player, zclreplay.PlayerState)):
         profile_id = profile.profile_id
 
     if cache.get(profile_id) is not None:
@@ -97,6 +209,39 @@ def fetch_or_create_profile(profile: typing.Union[str, zclreplay.Player], cache:
     cache[profile_id] = obj
     return obj
 
+def prefetch_profiles(profile_ids: typing.Iterable[str], cache: typing.Dict[str, typing.Any]) -> typing.List[str]:
+    """
+    Loads the profiles into a fetch_or_create_profile cache up front: one IN query for the ones we have, one insert
+    for the rest. bulk_create doesn't send post_save, so instead of a details task per new profile a single
+    get_profiles_details task is queued for all of them once the transaction commits.
+    Parameters
+    ----------
+    profile_ids: Every profile id that will be asked for. Ids already in the cache are skipped.
+    cache: As for fetch_or_create_profile
+
+    Returns
+    -------
+    List[str] of the profile ids that had to be created
+    """
+    from api.tasks import get_profiles_details
+    wanted = {pid for pid in profile_ids if pid is not None and cache.get(pid) is None}
+    if not wanted:
+        return []
+
+    found = SC2Profile.objects.in_bulk(wanted)
+    missing = sorted(wanted - found.keys())
+    if missing:
+        # Another worker may create some of them at the same time. Theirs win.
+        SC2Profile.objects.bulk_create(
+            [SC2Profile(id=pid, name='FOO') for pid in missing],
+            ignore_conflicts=True
+        )
+        found.update(SC2Profile.objects.in_bulk(missing))
+        transaction.on_commit(lambda: get_profiles_details.delay(missing))
+    cache.update(found)
+    return missing
+
+
 def get_or_create_profile(player: typing.Union[str, zclreplay.Player]) -> typing.Optional[SC2Profile]:
     profile_id = player
 
@@ -562,8 +562,11 @@ class ReplayUpload(APIView):
         user = request.user
         file: InMemoryUploadedFile = request.FILES['file']
         try:
-            tmp_replay = Replay(file)
-            game_id = tmp_replay.game_id
+            # Reads the upload in place. The file is left as it was for the
+            # storage upload below.
+            with Replay(file) as tmp_replay:
+                game_id = tmp_replay.game_id
+            file.seek(0)
             file.name = str(game_id)
 
             if self.match_exists_with_replay(game_id):
@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery.app.task import Task
+from celery.signals import worker_init, worker_process_init
 import logging
 
 log = logging.getLogger(__name__)
@@ -35,4 +36,46 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print('Request: {0!r}'.format(self.request))
\ No newline at end of file
+    print('Request: {0!r}'.format(self.request))
+
+
+@worker_init.connect
+def preload_protocols(**kwargs):
+    """
+    Import the common s2protocol builds once in the parent so that every
+    forked worker already has them.
+    """
+    from django.conf import settings
+    from zclreplay import protocols
+    loaded = protocols.preload(
+        builds=settings.REPLAY_PRELOAD_PROTOCOLS,
+        newest=settings.REPLAY_PRELOAD_NEWEST_PROTOCOLS,
+    )
+    log.info(f"Preloaded s2protocol builds {loaded}")
+
+
+@worker_init.connect
+def configure_stream_cache(**kwargs):
+    from django.conf import settings
+    from zclreplay import Replay
+    from zclreplay.streamcache import StreamCache
+    if settings.REPLAY_STREAM_CACHE_DIR:
+        Replay.stream_cache = StreamCache(
+            settings.REPLAY_STREAM_CACHE_DIR,
+            max_bytes=settings.REPLAY_STREAM_CACHE_MAX_BYTES,
+        )
+        log.info(f"Caching decoded replay streams in {settings.REPLAY_STREAM_CACHE_DIR}")
+
+
+@worker_process_init.connect
+def warm_dimension_caches(**kwargs):
+    """
+    Load the Unit and GameEventName lookups once per worker process. Done
+    after the fork so that no database connection is shared between them.
+    """
+    from api import dimensions
+    try:
+        dimensions.warm()
+    except Exception as e:
+        # They fill in on demand anyway
+        log.warning(f"Could not warm the dimension caches: {e}")
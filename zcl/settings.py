@@ -8,7 +8,8 @@ February, 2020
 
 import os
 import socket
-from decouple import config
+import tempfile
+from decouple import config, Csv
 import dj_database_url
 #import django_heroku
 
@@ -48,6 +49,39 @@ CELERY_BROKER_URL = REDIS_URL
 CELERY_TASK_SERIALIZER = 'pickle'
 CELERY_RESULT_SERIALIZER = 'pickle'
 CELERY_ACCEPT_CONTENT = ['json', 'application/x-python-serialize']
+# The second, full stats pass over a replay runs on a queue of its own, so
+# match results are always loaded ahead of it. Workers must consume both, in
+# this order: celery -A zcl worker -Q celery,replay_details
+# With the 'priority' strategy Redis drains the queues in the order given
+# instead of taking turns. priority_steps makes task priorities work at all.
+REPLAY_DETAILS_QUEUE = config('REPLAY_DETAILS_QUEUE', default='replay_details')
+# Celery priority of the pass within its queue. Redis treats 0 as the highest.
+REPLAY_DETAILS_PRIORITY = config('REPLAY_DETAILS_PRIORITY', cast=int, default=9)
+CELERY_TASK_ROUTES = {
+    'api.tasks.parse_replay_details': {'queue': REPLAY_DETAILS_QUEUE},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority',
+}
+# s2protocol builds the celery parent imports before forking workers. Explicit
+# base builds (comma separated) plus the newest N that s2protocol ships.
+REPLAY_PRELOAD_PROTOCOLS = config('REPLAY_PRELOAD_PROTOCOLS', default='', cast=Csv(int))
+REPLAY_PRELOAD_NEWEST_PROTOCOLS = config('REPLAY_PRELOAD_NEWEST_PROTOCOLS', cast=int, default=3)
+# Parse results cached by replay content. Off ('') by default, 'file' for a
+# local directory or 'django' for the cache named by REPLAY_RESULT_CACHE_ALIAS.
+REPLAY_RESULT_CACHE = config('REPLAY_RESULT_CACHE', default='')
+REPLAY_RESULT_CACHE_DIR = config('REPLAY_RESULT_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'zcl-replay-results'))
+REPLAY_RESULT_CACHE_ALIAS = config('REPLAY_RESULT_CACHE_ALIAS', default='default')
+REPLAY_RESULT_CACHE_MAX_BYTES = config('REPLAY_RESULT_CACHE_MAX_BYTES', cast=int, default=512 * 1024 * 1024)
+REPLAY_RESULT_CACHE_MAX_AGE = config('REPLAY_RESULT_CACHE_MAX_AGE', cast=int, default=7 * 24 * 60 * 60)
+# Directory for the decoded replay stream cache. Off when empty.
+REPLAY_STREAM_CACHE_DIR = config('REPLAY_STREAM_CACHE_DIR', default='')
+REPLAY_STREAM_CACHE_MAX_BYTES = config('REPLAY_STREAM_CACHE_MAX_BYTES', cast=int, default=4 * 1024 * 1024 * 1024)
+# Parse replays in a single pass without keeping the decoded tracker events.
+REPLAY_STREAMING = config('REPLAY_STREAMING', cast=bool, default=True)
+# Log peak memory and the top allocation sites of every parse. Slow.
+REPLAY_TRACE_MEMORY = config('REPLAY_TRACE_MEMORY', cast=bool, default=False)
 hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
 INTERNAL_IPS = [ip[:-1] + '1' for ip in ips] + ['127.0.0.1', '10.0.2.2']
 CHANNEL_LAYERS = {
@@ -1,4 +1,5 @@
 from .parser import Replay, NotZCReplay, IncompleteReplay, ReplayParseError
+from .errors import ParseTimeout
 from .serializer import ReplayObjectEncoder
 from .objects import *
 import logging
@@ -0,0 +1,178 @@
+"""
+Parses many replays at once across a process pool and streams the results as
+NDJSON, one line per replay. Used for backfills and for re-processing the
+archive after parser changes.
+
+    python -m zclreplay replays/ --workers 8 --timeout 120 -o results.ndjson
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import typing
+
+from .errors import NotZCReplay, IncompleteReplay, ParseTimeout
+from .parser import Replay
+from .serializer import ReplayObjectEncoder
+from .streamcache import StreamCache
+
+log = logging.getLogger(__name__)
+
+REPLAY_EXTENSION = '.SC2Replay'
+
+
+def iter_replay_paths(paths: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Expands directories into every .SC2Replay file below them."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith(REPLAY_EXTENSION):
+                    yield os.path.join(root, name)
+
+
+def summarize(replay: Replay) -> typing.Dict[str, typing.Any]:
+    """The parse results of a fully parsed Replay as plain data."""
+    segments = {}
+    for key, segment in replay.segments.items():
+        segments[key] = {
+            'gameloop': segment.get('gameloop'),
+            'game_time': segment.get('game_time'),
+            'valid': segment.get('valid'),
+            'players': [
+                dict(
+                    p.serialize(),
+                    left_game=p.left_game,
+                    eliminated=p.eliminated,
+                    eliminated_by=p.killer_id,
+                    total_score=p.total_score,
+                    minerals_on_hand=p.minerals_on_hand,
+                    units=p.overview,
+                )
+                for p in segment.get('players', [])
+            ],
+        }
+    return {
+        'details': replay.get_details(),
+        'game_length': replay.game_length,
+        'unit_stats': replay.unit_stats(),
+        'segments': segments,
+    }
+
+
+def _raise_timeout(signum, frame):
+    raise ParseTimeout("Parse took too long")
+
+
+def _init_worker(stream_cache: typing.Optional[str] = None):
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    if stream_cache:
+        Replay.stream_cache = StreamCache(stream_cache)
+    # Let the parent deal with Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parse_file(args: typing.Tuple[str, typing.Optional[int]]) -> typing.Dict[str, typing.Any]:
+    """
+    Parses a single replay inside a pool worker. Never raises; failures are
+    reported in the result so one bad replay doesn't take the batch down.
+    Parameters
+    ----------
+    args: (path, timeout in seconds or None)
+
+    Returns
+    -------
+    Dict with the file, status ('ok', 'skipped', 'timeout' or 'failed'), the
+    elapsed seconds and either the result or the error.
+    """
+    path, timeout = args
+    started = time.monotonic()
+    result = {'file': path}
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        with Replay(path) as replay:
+            replay.parse()
+            result['status'] = 'ok'
+            result['id'] = replay.game_id
+            result['result'] = summarize(replay)
+    except (NotZCReplay, IncompleteReplay) as e:
+        result['status'] = 'skipped'
+        result['error'] = str(e)
+    except ParseTimeout:
+        result['status'] = 'timeout'
+        result['error'] = f"Exceeded {timeout}s"
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{e.__class__.__name__}: {e}"
+    finally:
+        if timeout:
+            signal.alarm(0)
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_batch(paths: typing.Iterable[str], output: typing.TextIO, workers: int = None,
+              timeout: typing.Optional[int] = None, stream_cache: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+    """
+    Parses every replay over a pool of worker processes and writes a JSON line
+    for each as soon as it finishes, in completion order.
+    Parameters
+    ----------
+    paths: Replay files or directories of them
+    output: Where to write the NDJSON lines
+    workers: Number of processes. Defaults to the CPU count.
+    timeout: Per replay time limit in seconds.
+    stream_cache: Directory to cache decoded streams in, so re-running after
+        parser changes skips decoding.
+
+    Returns
+    -------
+    Dict of throughput and failure statistics for the run.
+    """
+    files = list(iter_replay_paths(paths))
+    stats = {'files': len(files), 'ok': 0, 'skipped': 0, 'timeout': 0, 'failed': 0, 'parse_seconds': 0.0}
+    started = time.monotonic()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(stream_cache,)) as pool:
+        jobs = ((path, timeout) for path in files)
+        for result in pool.imap_unordered(parse_file, jobs, chunksize=1):
+            stats[result['status']] += 1
+            stats['parse_seconds'] += result['seconds']
+            output.write(json.dumps(result, cls=ReplayObjectEncoder) + '\n')
+            output.flush()
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['parse_seconds'] = round(stats['parse_seconds'], 3)
+    stats['replays_per_second'] = round(len(files) / elapsed, 3) if elapsed else 0.0
+    return stats
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m zclreplay',
+        description='Parse replays in parallel and write the results as NDJSON.',
+    )
+    parser.add_argument('paths', nargs='+', help='.SC2Replay files or directories containing them')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('-t', '--timeout', type=int, default=None, help='per replay timeout in seconds')
+    parser.add_argument('-o', '--output', default='-', help='NDJSON output file (default: stdout)')
+    parser.add_argument('--stream-cache', default=None, help='directory to cache decoded replay streams in')
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        stats = run_batch(args.paths, output, workers=args.workers, timeout=args.timeout,
+                          stream_cache=args.stream_cache)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(json.dumps(stats), file=sys.stderr)
+    return 0 if stats['failed'] == 0 and stats['timeout'] == 0 else 1
@@ -6,3 +6,6 @@ class IncompleteReplay(Exception):
 
 class ReplayParseError(Exception):
     pass
+
+class ParseTimeout(Exception):
+    pass
@@ -0,0 +1,70 @@
+"""
+Optional tracemalloc report of how much memory a parse took and where.
+
+    with trace_memory(label=path) as report:
+        result = ParseResult.record(replay)
+    report.peak, report.top
+
+tracemalloc slows allocation down noticeably, so this is only meant to be
+switched on while sizing worker memory limits.
+"""
+import contextlib
+import logging
+import tracemalloc
+import typing
+
+log = logging.getLogger(__name__)
+
+
+class MemoryReport:
+    def __init__(self, label: str = ''):
+        self.label = label
+        # Bytes traced at the end of the block and at most during it
+        self.current = 0
+        self.peak = 0
+        # tracemalloc.Statistic of the largest allocations still alive at the end
+        self.top: typing.List[tracemalloc.Statistic] = []
+
+    def format(self) -> str:
+        lines = [f"{self.label} - Peak {self.peak / 1024 / 1024:.1f} MiB, "
+                 f"{self.current / 1024 / 1024:.1f} MiB at the end"]
+        lines += [f"    {stat}" for stat in self.top]
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def trace_memory(label: str = '', limit: int = 10, frames: int = 1) -> typing.Iterator[MemoryReport]:
+    """
+    Traces allocations in the block and logs a MemoryReport at the end.
+    Parameters
+    ----------
+    label: Identifies the parse in the log, like the replay path
+    limit: How many allocation sites to list
+    frames: Stack frames kept per allocation. Only if tracing isn't on yet.
+
+    Returns
+    -------
+    MemoryReport, filled in once the block exits. Take anything worth seeing in
+    top before the block lets go of it.
+    """
+    report = MemoryReport(label)
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        yield report
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        # Memory traced before the block isn't ours. Without reset_peak (3.9)
+        # the peak of an outer trace may be from before the block as well.
+        report.current = max(current - baseline, 0)
+        report.peak = max(peak - baseline, 0)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        report.top = snapshot.statistics('lineno')[:limit]
+        if started:
+            tracemalloc.stop()
+        log.info(report.format())
@@ -1,11 +1,11 @@
 import datetime
 import re
 import typing
-from decimal import Decimal
 import collections
 import logging
 from copy import deepcopy
 from .units import UNIT_VALUES
+from . import utils
 
 log = logging.getLogger(__name__)
 
@@ -26,24 +26,65 @@ class UpgradeEvent:
         pass
 
 class MessageEvent:
-    def __init__(self, profile, game_time, message_type, message):
+    def __init__(self, profile, gameloop, message_type, message):
         self.profile = profile
-        self.game_time = game_time
+        self.gameloop = gameloop
         self.message_type = message_type
         self.message = message
 
+    @property
+    def game_time(self) -> str:
+        return utils.game_time(self.gameloop)
+
+
+# Integer codes for the event types we look at. Each event resolves its code
+# once when it is wrapped, so checking the type is an int comparison.
+OTHER_EVENT = 0
+UNIT_BORN = 1
+UNIT_INIT = 2
+UNIT_DONE = 3
+UNIT_DIED = 4
+PLAYER_STATS = 5
+PLAYER_SETUP = 6
+UPGRADE = 7
+UNIT_OWNER_CHANGE = 8
+UNIT_TYPE_CHANGE = 9
+UNIT_POSITIONS = 10
+SYNC_LOADING_TIME = 11
+CHAT_MESSAGE = 12
+
+EVENT_KINDS = {
+    'NNet.Replay.Tracker.SUnitBornEvent': UNIT_BORN,
+    'NNet.Replay.Tracker.SUnitInitEvent': UNIT_INIT,
+    'NNet.Replay.Tracker.SUnitDoneEvent': UNIT_DONE,
+    'NNet.Replay.Tracker.SUnitDiedEvent': UNIT_DIED,
+    'NNet.Replay.Tracker.SPlayerStatsEvent': PLAYER_STATS,
+    'NNet.Replay.Tracker.SPlayerSetupEvent': PLAYER_SETUP,
+    'NNet.Replay.Tracker.SUpgradeEvent': UPGRADE,
+    'NNet.Replay.Tracker.SUnitOwnerChangeEvent': UNIT_OWNER_CHANGE,
+    'NNet.Replay.Tracker.SUnitTypeChangeEvent': UNIT_TYPE_CHANGE,
+    'NNet.Replay.Tracker.SUnitPositionsEvent': UNIT_POSITIONS,
+    'NNet.Game.SSetSyncLoadingTimeEvent': SYNC_LOADING_TIME,
+    'NNet.Game.SChatMessage': CHAT_MESSAGE,
+}
 
 class Event(dict):
+    """
+    A decoded replay event. It is still a plain dict of the s2protocol fields,
+    with the event type resolved to one of the integer codes above and every
+    bytes value decoded to str. No per instance __dict__ is kept.
+    """
+    __slots__ = ('_event', 'kind')
 
     def __init__(self, *args, **kwargs):
         super(Event, self).__init__(*args, **kwargs)
         self._event = self.get('_event')
+        self.kind = EVENT_KINDS.get(self._event, OTHER_EVENT)
 
         # The default return value is bytes for quite a few of the units.
         # Encode them to strings for easier parsing.
         for key, value in self.items():
-            if isinstance(value, bytes):
-                value:bytes
+            if value.__class__ is bytes:
                 self[key] = value.decode(encoding='utf-8')
 
     @property
@@ -51,49 +92,53 @@ class Event(dict):
         """Returns the unit name if any"""
         return self.get('m_unitTypeName')
 
+    @property
+    def owner_id(self) -> typing.Optional[int]:
+        return self.get('m_controlPlayerId')
+
     @property
     def unit_born(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitBornEvent'
+        return self.kind == UNIT_BORN
 
     @property
     def unit_init(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitInitEvent'
+        return self.kind == UNIT_INIT
 
     @property
     def unit_done(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitDoneEvent'
+        return self.kind == UNIT_DONE
 
     @property
     def unit_died(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitDiedEvent'
+        return self.kind == UNIT_DIED
 
     @property
     def stats_update(self) -> bool:
-        return self._event == "NNet.Replay.Tracker.SPlayerStatsEvent"
+        return self.kind == PLAYER_STATS
 
     @property
     def time_event(self) -> bool:
-        return self._event == "NNet.Game.SSetSyncLoadingTimeEvent"
+        return self.kind == SYNC_LOADING_TIME
 
     @property
     def player_setup(self) -> bool:
-        return self._event == "NNet.Replay.Tracker.SPlayerSetupEvent"
+        return self.kind == PLAYER_SETUP
 
     @property
     def upgrade_event(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUpgradeEvent'
+        return self.kind == UPGRADE
 
     @property
     def unit_owner_transferred(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitOwnerChangeEvent'
+        return self.kind == UNIT_OWNER_CHANGE
 
     @property
     def unit_type_changed(self) -> bool:
-        return self._event == 'NNet.Replay.Tracker.SUnitTypeChangeEvent'
+        return self.kind == UNIT_TYPE_CHANGE
 
     @property
     def message_received(self) -> bool:
-        return self._event == 'NNet.Game.SChatMessage'
+        return self.kind == CHAT_MESSAGE
 
     @property
     def position(self) -> typing.Optional[int]:
@@ -105,11 +150,12 @@ class Event(dict):
         return x + (round(y * 8.0))
 
     @property
-    def game_time(self):
-        game_time = Decimal(self.get('_gameloop', 0))
-        game_time = game_time / Decimal("16")   # Trigger update time
-        game_time = game_time / Decimal("1.4")  # Map speed Faster
-        return str(round(game_time, 4))           # in seconds
+    def gameloop(self) -> int:
+        return self.get('_gameloop', 0)
+
+    @property
+    def game_time(self) -> str:
+        return utils.game_time(self.get('_gameloop', 0))
 
     @property
     def formatted_game_time(self):
@@ -127,8 +173,7 @@ class Event(dict):
 
     def is_unit(self, unit_name: str, key='m_unitTypeName') -> bool:
         unit = self.get(key)
-        encoded = unit_name.encode('utf-8')
-        return unit == encoded or unit == unit_name
+        return unit == unit_name or unit == unit_name.encode('utf-8')
 
 
 
@@ -156,8 +201,10 @@ class Player:
         self.allied_chats = []
         self.winner = False
         self.killer = None
-        self.eliminated_at = 0.0
+        self.eliminated_at_loop = 0
         self.upgrade_totals = {}
+        self._state: typing.Optional[PlayerState] = None
+        self._state_key = None
 
 
 
@@ -165,10 +212,14 @@ class Player:
     def is_eliminated(self) -> bool:
         return self.left_game or self.eliminated
 
+    @property
+    def eliminated_at(self) -> str:
+        return utils.game_time(self.eliminated_at_loop)
+
     @property
     def has_no_bunkers(self) -> bool:
-        bunkers = self.unit_stats.bunkers
-        return bunkers['created'] - bunkers.get('cancelled', 0) - bunkers['lost'] == 0
+        created, _, lost, cancelled = self.unit_stats.unit_counts('Bunker')
+        return created - cancelled - lost == 0
 
 
 
@@ -276,6 +327,51 @@ class Player:
         else:
             return ",".join(map(str, self.color))
 
+    def snapshot(self) -> 'PlayerState':
+        """
+        Freezes the current state of the player into a PlayerState. If nothing
+        has changed since the last call the same instance is returned, so
+        taking one for every match event costs next to nothing.
+
+        upgrade_totals must be replaced rather than mutated in place for this
+        to notice a change.
+        Returns
+        -------
+        PlayerState
+        """
+        stats = self.unit_stats
+        key = (
+            stats.version, stats.stat_event, self.upgrade_totals, self.left_game,
+            self.eliminated, self.winner, self.victim_number, self.killer,
+            self.eliminated_at_loop,
+        )
+        if self._state is not None and key == self._state_key:
+            return self._state
+
+        killer = self.killer
+        self._state = PlayerState(
+            player_id=self.player_id,
+            user_id=self.user_id,
+            profile_id=self.profile_id,
+            name=self.name,
+            team_id=None if self.team is None else self.team.id,
+            lane_id=None if self.lane is None else self.lane.profile_id,
+            position=self.position,
+            color=self.color,
+            left_game=self.left_game,
+            eliminated=self.eliminated,
+            winner=self.winner,
+            victim_number=self.victim_number,
+            eliminated_at_loop=self.eliminated_at_loop,
+            killer_id=None if killer is None else killer.profile_id,
+            killer_name=None if killer is None else killer.name,
+            stat_event=stats.stat_event,
+            unit_counts=stats.frozen_counts(),
+            upgrade_totals=self.upgrade_totals,
+        )
+        self._state_key = key
+        return self._state
+
     def __repr__(self):
         return "Player(name={0.name}, player_id={0.player_id}, team_id={0.team.id}, position={0.position})".format(self)
 
@@ -316,6 +412,129 @@ class Player:
 
         return result
 
+class PlayerState(typing.NamedTuple):
+    """
+    Immutable record of a Player at one point of the game.
+
+    Match events, snapshots and segments keep these rather than deep copies of
+    the player graph. Other players are only referenced by profile id, and the
+    stat event, unit overview and upgrade totals are shared with the live
+    Player, which replaces them instead of mutating them. Treat them as read
+    only.
+    """
+    player_id: typing.Optional[int]
+    user_id: typing.Optional[int]
+    profile_id: typing.Optional[str]
+    name: typing.Optional[str]
+    team_id: typing.Optional[int]
+    lane_id: typing.Optional[str]
+    position: typing.Optional[int]
+    color: typing.Optional[tuple]
+    left_game: bool
+    eliminated: bool
+    winner: bool
+    victim_number: int
+    eliminated_at_loop: int
+    killer_id: typing.Optional[str]
+    killer_name: typing.Optional[str]
+    stat_event: typing.Mapping[str, typing.Any]
+    unit_counts: typing.Mapping[str, 'UnitCounts']
+    upgrade_totals: typing.Mapping[str, int]
+
+    @property
+    def is_eliminated(self) -> bool:
+        return self.left_game or self.eliminated
+
+    @property
+    def eliminated_at(self) -> str:
+        return utils.game_time(self.eliminated_at_loop)
+
+    @property
+    def stats(self) -> typing.Mapping[str, int]:
+        return self.stat_event.get('m_stats', {})
+
+    @property
+    def total_score(self) -> int:
+        return self.stats.get('m_scoreValueMineralsKilledArmy', 0) + self.stats.get('m_scoreValueMineralsKilledEconomy', 0)
+
+    @property
+    def minerals_on_hand(self) -> int:
+        return self.stats.get('m_scoreValueMineralsCurrent', 0)
+
+    @property
+    def army_value(self) -> int:
+        return self.stats.get('m_scoreValueMineralsUsedCurrentArmy', 0)
+
+    @property
+    def tech_value(self) -> int:
+        return self.stats.get('m_scoreValueMineralsUsedCurrentTechnology', 0)
+
+    @property
+    def lost_tech_value(self) -> int:
+        return self.stats.get('m_scoreValueMineralsLostTechnology', 0)
+
+    @property
+    def tech_damage_value(self) -> int:
+        return self.stats.get('m_scoreValueMineralsKilledTechnology', 0)
+
+    @property
+    def overview(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Same shape as Stats.overview"""
+        return {u: c._asdict() for u, c in self.unit_counts.items()}
+
+    def filter_and_sum(self, unit: typing.Union[str, typing.Iterable[str]]) -> typing.Dict[str, int]:
+        """Same as Stats.filter_and_sum over every player"""
+        units = [unit] if isinstance(unit, str) else unit
+        result = [0] * len(UNIT_CATEGORIES)
+        for u in units:
+            counts = self.unit_counts.get(u)
+            if counts is not None:
+                result = [a + b for a, b in zip(result, counts)]
+        return dict(zip(UNIT_CATEGORIES, result))
+
+    @property
+    def bunkers(self) -> typing.Dict[str, int]:
+        return self.filter_and_sum('Bunker')
+
+    @property
+    def tanks(self) -> typing.Dict[str, int]:
+        return self.filter_and_sum('SiegeBreakerSieged')
+
+    @property
+    def depots(self) -> typing.Dict[str, int]:
+        return self.filter_and_sum('SupplyDepot')
+
+    @property
+    def nukes(self) -> typing.Dict[str, int]:
+        return self.filter_and_sum('Nuke')
+
+    @property
+    def biological_stats(self) -> typing.Dict[str, int]:
+        created, killed, lost, _ = self.filter_and_sum(BIOLOGICAL_UNITS).values()
+        return {'created': created, 'killed': killed, 'lost': lost}
+
+    @property
+    def color_string(self) -> str:
+        if self.color is None:
+            return ""
+        return ",".join(map(str, self.color))
+
+    def serialize(self):
+        return {
+            'id': self.profile_id,
+            'name': self.name,
+            'lane_id': self.lane_id,
+            'position': self.position,
+            'color': self.color
+        }
+
+
+def freeze_player(player: typing.Union[Player, PlayerState, None]) -> typing.Optional[PlayerState]:
+    if player is None or isinstance(player, PlayerState):
+        return player
+    return player.snapshot()
+
+
 class Team:
     def __init__(self, team_id: int, players: typing.Optional[typing.List[Player]] = None):
         if players is None:
@@ -362,31 +581,83 @@ class Team:
 
 
 class TrackedUnits:
+    """Unit init/born events by unit tag, until the unit dies."""
     def __init__(self):
         self._tracked = {}
 
+    @staticmethod
+    def _key(event: Event, killer=False):
+        if killer:
+            return "{m_killerUnitTagIndex}-{m_killerUnitTagRecycle}".format(**event)
+        return "{m_unitTagIndex}-{m_unitTagRecycle}".format(**event)
+
+    def __len__(self) -> int:
+        return len(self._tracked)
+
     def add(self, event: Event) -> None:
-        key = "{m_unitTagIndex}-{m_unitTagRecycle}".format(**event)
-        self._tracked[key] = event
+        self._tracked[self._key(event)] = event
 
     def fetch(self, event: Event, killer=False) -> typing.Optional[Event]:
         try:
-            if killer:
-                key = "{m_killerUnitTagIndex}-{m_killerUnitTagRecycle}".format(**event)
-            else:
-                key = "{m_unitTagIndex}-{m_unitTagRecycle}".format(**event)
-            return self._tracked.get(key)
+            key = self._key(event, killer)
         except KeyError:
             return
+        return self._tracked.get(key)
+
+    def transfer(self, event: Event, owner_id: int) -> None:
+        """Records the new owner of the unit in an owner change event."""
+        # Decoded events are shared by every reader of the stream. Replace the
+        # tracked event with a copy so the change doesn't leak back into them.
+        unit = Event(self._tracked[self._key(event)])
+        unit['m_controlPlayerId'] = owner_id
+        unit['m_upkeepPlayerId'] = owner_id
+        self.add(unit)
 
     def delete(self, event: Event) -> None:
-        key = "{m_unitTagIndex}-{m_unitTagRecycle}".format(**event)
         try:
-
-            del self._tracked[key]
+            del self._tracked[self._key(event)]
         except KeyError:
             log.warning("Called TrackUnits.delete() on non-existant key")
 
+
+class TrackedUnit:
+    """The parts of a unit init/born event the parser needs once the unit dies."""
+    __slots__ = ('tag', 'owner_id', 'unit')
+
+    def __init__(self, tag: int, owner_id: typing.Optional[int], unit: typing.Optional[str]):
+        self.tag = tag
+        self.owner_id = owner_id
+        self.unit = unit
+
+    def is_unit(self, unit_name: str) -> bool:
+        return self.unit == unit_name
+
+    def __repr__(self):
+        return f"TrackedUnit(tag={self.tag}, owner_id={self.owner_id}, unit={self.unit})"
+
+
+class CompactTrackedUnits(TrackedUnits):
+    """
+    TrackedUnits for streaming. Keeps a TrackedUnit (tag, owner and type) per
+    unit instead of the whole event. Units that never die, like mineral
+    spawns and map objects, otherwise pile up over a long game.
+    """
+
+    @staticmethod
+    def _key(event: Event, killer=False) -> int:
+        # The same packing as s2protocol's unit_tag()
+        if killer:
+            return (event['m_killerUnitTagIndex'] << 18) + event['m_killerUnitTagRecycle']
+        return (event['m_unitTagIndex'] << 18) + event['m_unitTagRecycle']
+
+    def add(self, event: Event) -> None:
+        key = self._key(event)
+        self._tracked[key] = TrackedUnit(key, event.owner_id, event.unit)
+
+    def transfer(self, event: Event, owner_id: int) -> None:
+        unit = self._tracked[self._key(event)]
+        self._tracked[unit.tag] = TrackedUnit(unit.tag, owner_id, unit.unit)
+
 class MatchEvent:
     def __init__(self, event: Event, key: str, description: str, profile: Player,
                  opposing_profile: Player, player_state: typing.List[Player], points: int = 0, value: int = 0, raw: str = ""):
@@ -396,16 +667,28 @@ class MatchEvent:
         self.points = points
         self.value = value
         self.raw = raw
-        self.profile = deepcopy(profile)
-        self.opposing_profile = deepcopy(opposing_profile)
-        self.game_time = event.game_time
-        self.player_state = [deepcopy(p) for p in player_state]
-        self.total_score = 0 if self.profile is None else self.profile.unit_stats.total_score
-        self.minerals_on_hand = 0 if self.profile is None else self.profile.unit_stats.minerals_on_hand
+        self.profile = freeze_player(profile)
+        self.opposing_profile = freeze_player(opposing_profile)
+        self.gameloop = event.gameloop
+        self.player_state = [freeze_player(p) for p in player_state]
+
+    # Read from whoever ends up as the profile. add_match_event moves the
+    # killer into it for events like nukes after the MatchEvent is made.
+    @property
+    def total_score(self) -> int:
+        return 0 if self.profile is None else self.profile.total_score
+
+    @property
+    def minerals_on_hand(self) -> int:
+        return 0 if self.profile is None else self.profile.minerals_on_hand
+
+    @property
+    def game_time(self) -> str:
+        return utils.game_time(self.gameloop)
 
     def serialize(self):
-        profile = self.profile.profile_id if isinstance(self.profile, Player) else None
-        opposing_profile = self.opposing_profile.profile_id if isinstance(self.opposing_profile, Player) else None
+        profile = self.profile.profile_id if self.profile is not None else None
+        opposing_profile = self.opposing_profile.profile_id if self.opposing_profile is not None else None
         return {
             'key': self.key,
             'description': self.description,
@@ -419,11 +702,9 @@ class MatchEvent:
 
         }
     def __repr__(self):
-        gameloop = self.event['_gameloop']
         player = self.profile.name
-        return "MatchEvent(key={0.key}, gameloop={1} player={2}".format(
+        return "MatchEvent(key={0.key}, gameloop={0.gameloop} player={1}".format(
             self,
-            gameloop,
             player
         )
 
@@ -431,8 +712,8 @@ class Snapshot:
 
     def __init__(self, event: MatchEvent, players: typing.List[Player]):
         self.event = event
-        self.game_time = event.game_time
-        self.players = deepcopy(players)
+        self.gameloop = event.gameloop
+        self.players = [freeze_player(p) for p in players]
         container = []
         for p in players:
             result = {}
@@ -441,6 +722,10 @@ class Snapshot:
             container.append(result)
         self.serialized_players = container
 
+    @property
+    def game_time(self) -> str:
+        return utils.game_time(self.gameloop)
+
     def find_player(self, player_id):
         for p in self.players:
             if p.player_id == player_id:
@@ -457,6 +742,25 @@ class Snapshot:
 
 
 
+UNIT_CATEGORIES = ('created', 'killed', 'lost', 'cancelled')
+CATEGORY_INDEX = {c: i for i, c in enumerate(UNIT_CATEGORIES)}
+BIOLOGICAL_UNITS = frozenset([
+    'Spectre',
+    'Reaper',
+    'Marine',
+    'Ghost',
+    'WarPig',
+    'MercReaper',
+])
+
+
+class UnitCounts(typing.NamedTuple):
+    created: int = 0
+    killed: int = 0
+    lost: int = 0
+    cancelled: int = 0
+
+
 class Stats:
     """
     b'Spectre'
@@ -489,8 +793,38 @@ b'SupplyDepot'
         self.profile = profile
         self.stat_event = {}
         self.new_totals: collections.defaultdict[Player, typing.Any] = collections.defaultdict(dict)
-
-
+        # Running aggregates of self.totals, kept up to date in increment() and
+        # transfer() so reads never walk the nested totals.
+        # unit -> [created, killed, lost, cancelled]
+        self._counts: typing.Dict[str, typing.List[int]] = {}
+        # (opponent profile_id, unit) -> [created, killed, lost, cancelled]
+        self._against: typing.Dict[typing.Tuple[str, str], typing.List[int]] = {}
+        self._biological = [0] * len(UNIT_CATEGORIES)
+        # Bumped on every change to the totals so snapshots can be shared
+        # until something actually changes.
+        self.version = 0
+        self._frozen_counts = None
+        # Shared list a TimelineRecorder reads. Every counter change is
+        # appended to it as (profile, unit, category index, n) while set.
+        self.journal: typing.Optional[typing.List[typing.Tuple[Player, str, int, int]]] = None
+
+    def _add(self, ref: Player, unit: str, category: str, n: int):
+        index = CATEGORY_INDEX.get(category)
+        if index is None:
+            return
+        counts = self._counts.get(unit)
+        if counts is None:
+            counts = self._counts[unit] = [0] * len(UNIT_CATEGORIES)
+        counts[index] += n
+        key = (ref.profile_id, unit)
+        against = self._against.get(key)
+        if against is None:
+            against = self._against[key] = [0] * len(UNIT_CATEGORIES)
+        against[index] += n
+        if unit in BIOLOGICAL_UNITS:
+            self._biological[index] += n
+        if self.journal is not None:
+            self.journal.append((self.profile, unit, index, n))
 
     def increment(self, player: typing.Optional[Player], unit: str, category: str) -> int:
         ref = player if player is not None else self.profile
@@ -502,10 +836,14 @@ b'SupplyDepot'
         n = self.totals.get(ref, {}).get(unit, {}).get(category, 0)
 
         self.totals[ref][unit][category] = n + 1
+        self._add(ref, unit, category, 1)
+        self.version += 1
         return self.totals[ref][unit][category]
 
     def transfer(self, new_owner: Player, unit: str):
         self.totals[self.profile][unit]['created'] -= 1
+        self._add(self.profile, unit, 'created', -1)
+        self.version += 1
         new_owner.unit_stats.increment(new_owner, unit, 'created')
 
         #new_owner.unit_stats.totals[new_owner][unit]['created'] += 1
@@ -549,7 +887,7 @@ b'SupplyDepot'
 
     @property
     def units(self):
-        return list(set(unit for player in self.totals.keys() for unit in self.totals[player].keys()))
+        return list(self._counts.keys())
 
     @property
     def bunkers(self):
@@ -582,22 +920,8 @@ b'SupplyDepot'
         return self.get_biological_stats()
 
     def get_biological_stats(self, player: typing.Optional[Player] = None):
-        result = {'created': 0, 'killed': 0, 'lost': 0}
-        units = [
-            'Spectre',
-            'Reaper',
-            'Marine',
-            'Ghost',
-            'WarPig',
-            'MercReaper',
-
-        ]
-        for u in units:
-            stats = self.filter_and_sum(u)
-            result['created'] += stats['created']
-            result['killed'] += stats['killed']
-            result['lost'] += stats['lost']
-        return result
+        created, killed, lost, _ = self._biological
+        return {'created': created, 'killed': killed, 'lost': lost}
 
     @property
     def tanks(self):
@@ -609,37 +933,40 @@ b'SupplyDepot'
         return against_stats
 
 
-    def filter_and_sum(self, unit: str, against: typing.Optional[Player] = None) -> typing.Optional[typing.Dict[str, int]]:
-        result = {'created': 0, 'killed': 0, 'lost': 0, 'cancelled': 0}
-        predicate = True
-        for key in self.totals.keys():
-            if against is not None:
-                predicate = key.profile_id == against.profile_id
-            # This is the player and global state
-            for u in self.totals[key]:
-
-                if u == unit and predicate:
-                    result['created'] += self.totals[key][u].get('created', 0)
-                    result['killed'] += self.totals[key][u].get('killed', 0)
-                    result['lost'] += self.totals[key][u].get('lost', 0)
-                    result['cancelled'] += self.totals[key][u].get('cancelled', 0)
-
-        return result
+    def filter_and_sum(self, unit: typing.Union[str, typing.Iterable[str]], against: typing.Optional[Player] = None) -> typing.Optional[typing.Dict[str, int]]:
+        """
+        Sums the created/killed/lost/cancelled counts of one or more units,
+        either over every player or only against the given one.
+        """
+        units = [unit] if isinstance(unit, str) else unit
+        result = [0] * len(UNIT_CATEGORIES)
+        for u in units:
+            if against is None:
+                counts = self._counts.get(u)
+            else:
+                counts = self._against.get((against.profile_id, u))
+            if counts is not None:
+                result = [a + b for a, b in zip(result, counts)]
+        return dict(zip(UNIT_CATEGORIES, result))
 
     @property
     def overview(self) -> typing.Optional[typing.Dict[str, typing.Dict[str, int]]]:
-        result = {}
-        for key in self.totals.keys():
-            for u in self.totals[key]:
-                if u not in result.keys():
-                    result[u] = {'created': 0, 'killed': 0, 'lost': 0, 'cancelled': 0}
-                result[u]['created'] += self.totals[key][u].get('created', 0)
-                result[u]['killed'] += self.totals[key][u].get('killed', 0)
-                result[u]['lost'] += self.totals[key][u].get('lost', 0)
-                result[u]['cancelled'] += self.totals[key][u].get('cancelled', 0)
+        return {u: dict(zip(UNIT_CATEGORIES, counts)) for u, counts in self._counts.items()}
 
-        return result
+    def unit_counts(self, unit: str) -> 'UnitCounts':
+        counts = self._counts.get(unit)
+        return UnitCounts() if counts is None else UnitCounts(*counts)
 
+    def frozen_counts(self) -> typing.Dict[str, 'UnitCounts']:
+        """
+        Immutable copy of the per unit counters as of the current version. It
+        is only rebuilt after the totals change, so every snapshot in between
+        shares one copy.
+        """
+        if self._frozen_counts is None or self._frozen_counts[0] != self.version:
+            counts = {u: UnitCounts(*c) for u, c in self._counts.items()}
+            self._frozen_counts = (self.version, counts)
+        return self._frozen_counts[1]
 
     def all(self):
         exclude = [
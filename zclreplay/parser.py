@@ -2,14 +2,21 @@ import json
 import logging
 import typing
 import collections
+import heapq
+import operator
 import mpyq
-from s2protocol import versions
 
 from zclreplay.errors import NotZCReplay, IncompleteReplay, ReplayParseError
 from zclreplay.objects import Event, TrackedUnits, Team, Player, MatchEvent, Snapshot
+from zclreplay.objects import UNIT_BORN, UNIT_INIT, UNIT_DIED, PLAYER_STATS, UPGRADE, UNIT_OWNER_CHANGE, CHAT_MESSAGE
+from zclreplay.objects import EVENT_KINDS
+from zclreplay.streams import DecodedStream, tracker_event_ids, decode_stream
+from zclreplay.streamcache import StreamCache, entry_name
+from zclreplay.results import content_hash
+from zclreplay import protocols
+from zclreplay.sources import open_source
 from datetime import datetime, timezone
 import re
-from copy import deepcopy
 from . import utils
 
 
@@ -47,24 +54,15 @@ LANE_POSITION_MAP = {
     7: 0,
 
 }
+_gameloop = operator.attrgetter('gameloop')
 
-def closest_version(n, versions) -> (int, int):
-    """
-    s2protocol may be missing a particular protocol. Find the closest one two it down-versioned and upversioned.
-    Parameters
-    ----------
-    n
-    versions: s2protocol.versions
+# Player attributes that Replay.get_player() can look up without a scan.
+PLAYER_INDEX_KEYS = ('player_id', 'user_id', 'profile_id')
 
-    Returns
-    -------
 
-    """
-    seq = list(map(int, re.findall('\\d+', ''.join(versions.list_all()))))
-    lst = sorted(seq + [n])
-    min_index = lst.index(n) - 1
-    max_index = min(min_index + 2, len(lst)-1)
-    return seq[min_index], lst[max_index]
+def _decode_header(archive) -> dict:
+    """The replay header. Every build decodes it the same, so the latest protocol does."""
+    return protocols.latest().decode_replay_header(archive.header['user_data_header']['content'])
 
 
 class SerializeEncoder(json.JSONEncoder):
@@ -81,76 +79,155 @@ class SerializeEncoder(json.JSONEncoder):
         return {'__{}__'.format(o.__class__.__name__): o.__dict__}
 
 class Replay:
-
+    # Set to a StreamCache to keep the decoded streams of every replay on disk
+    # and read them back instead of decoding again.
+    stream_cache: typing.Optional[StreamCache] = None
+    # Streams worth caching. Game events are only ever read up to the sync
+    # event, which is cheap.
+    CACHED_STREAMS = ('replay.tracker.events', 'replay.message.events')
+    # Keep the handled tracker events around for anyone reading them again.
+    # They are read once per parse, so by default they are let go as soon as
+    # they have been handled.
+    retain_events = False
 
     @classmethod
     def info(cls, path):
-        archive = mpyq.MPQArchive(path)
-        hash = archive.__hash__()
-        meta = json.loads(
-            archive.read_file('replay.gamemetadata.json')
-            .decode('utf-8')
-        )
+        source = open_source(path)
+        try:
+            archive = mpyq.MPQArchive(source)
+            hash = archive.__hash__()
+            meta = json.loads(
+                archive.read_file('replay.gamemetadata.json')
+                .decode('utf-8')
+            )
+        finally:
+            if source is not path:
+                source.close()
         return hash, meta
 
-    def __init__(self, path):
-        self.archive = mpyq.MPQArchive(path)
-        self.fallback_versions = None
-        _header_contents = self.archive.header['user_data_header']['content']
-        protocol = versions.latest()
-        _header = protocol.decode_replay_header(_header_contents)
-        self.base_build = _header['m_version']['m_baseBuild']
+    @classmethod
+    def read_base_build(cls, path) -> int:
+        """The m_baseBuild of a replay, from its header alone."""
+        source = open_source(path)
         try:
-            self.protocol = versions.build(self.base_build)
-        except ImportError:
-            # fall back version
-            next_lower = closest_version(self.base_build, versions)[0]
-            log.info(f"Missing Protocol {self.base_build}. Using Next Lower {next_lower}")
-            self.protocol = versions.build(next_lower)
-
-        self.fallback_versions = closest_version(self.base_build, versions)
-        self._header = _header
-        self._events = None
-        self._init_data = None
-        self._details = None
-        self._players = []
-        self._teams = None
-        self._attribute_events = None
-        self._tracker_events = None
-        self.match_events = []
-        self.snapshots: typing.List[Snapshot] = []
-        self.tracked_units = TrackedUnits()
-        self._time = None
-        self.units = []
-        self._message_lookup = {}
-        self._message_keys = []
-        self.segments = {
-            'early': {},
-            'three_teams': {},
-            'two_teams': {},
-            'final': {}
-        }
-        meta = json.loads(
-            self.archive.read_file('replay.gamemetadata.json')
-            .decode('utf-8')
-        )
-        self.meta = meta
-        if meta['Title'] not in ['Zone Control CE', 'Zone Control CE Dev']:
-            raise NotZCReplay("Not a valid replay for game")
-        # Check to see if the replay is complete or not
-        if max([p['m_result'] for p in self.details.get('m_playerList', [])]) == 0:
-            raise IncompleteReplay("Replay is incomplete")
+            return _decode_header(mpyq.MPQArchive(source))['m_version']['m_baseBuild']
+        finally:
+            if source is not path:
+                source.close()
+
+    def __init__(self, path, digest: typing.Optional[str] = None):
+        """
+        Parameters
+        ----------
+        path: Path to the replay, its bytes or a memoryview of them, or any
+            binary file. Paths are memory mapped and buffers read in place, so
+            only the parts of the archive we decode are ever read.
+        digest: content_hash of the replay, if the caller already has it
+        """
+        self._source = open_source(path)
+        self._owns_source = self._source is not path
+        try:
+            self._content_digest = digest
+            self.archive = mpyq.MPQArchive(self._source)
+            self.fallback_versions = None
+            _header = _decode_header(self.archive)
+            self.base_build = _header['m_version']['m_baseBuild']
+            self.protocol = protocols.resolve(self.base_build)
+            self.fallback_versions = protocols.closest_builds(self.base_build)
+            self._header = _header
+            # MPQ file name -> the retained DecodedStreams, shared by every reader.
+            self._streams: typing.Dict[typing.Any, DecodedStream] = {}
+            self._init_data = None
+            self._details = None
+            self._players = []
+            self._active_players = ()
+            self._player_index = None
+            self._teams = None
+            self._active_teams = []
+            # Kept up to date by _mark_eliminated() so nothing has to scan for them
+            self._player_dead_count = 0
+            self._team_dead_count = 0
+            self._teams_remaining = 0
+            # Set whenever the team count changes, so segments only look then
+            self._team_segments_due = True
+            self._attribute_events = None
+            self.match_events = []
+            self.snapshots: typing.List[Snapshot] = []
+            self.tracked_units = TrackedUnits()
+            self._time = None
+            self._sync_time = None
+            self._sync_time_loaded = False
+            self.units = []
+            self.segments = {
+                'early': {},
+                'three_teams': {},
+                'two_teams': {},
+                'final': {}
+            }
+            # Event kind -> handlers called with each tracker event of that kind.
+            self._handlers: typing.Dict[int, typing.List[typing.Callable[[Event], typing.Any]]] = {}
+            self._register_handlers()
+            meta = json.loads(
+                self.archive.read_file('replay.gamemetadata.json')
+                .decode('utf-8')
+            )
+            self.meta = meta
+            if meta['Title'] not in ['Zone Control CE', 'Zone Control CE Dev']:
+                raise NotZCReplay("Not a valid replay for game")
+            # Check to see if the replay is complete or not
+            if max([p['m_result'] for p in self.details.get('m_playerList', [])]) == 0:
+                raise IncompleteReplay("Replay is incomplete")
+        except BaseException:
+            # Don't keep a mapping or an export of the caller's buffer alive
+            # for a replay nobody can close.
+            self.close()
+            raise
+
+
+    def register_handler(self, kind: int, handler: typing.Callable[[Event], typing.Any]):
+        """
+        Subscribes a handler to every tracker event of the given kind. Handlers
+        run in the order they were registered. This is how new stat collectors
+        plug into the parse loop without touching it.
+
+        Tracker events of a kind nobody subscribed to are skipped outright.
+        Parameters
+        ----------
+        kind: One of the event kind codes in zclreplay.objects (UNIT_BORN, ...)
+        handler: Called with the Event. Whatever it returns is yielded as the
+            payload of the event by StreamParser.
+
+        Returns
+        -------
+        None
+        """
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def _register_handlers(self):
+        self.register_handler(UNIT_OWNER_CHANGE, self._parse_transferred)
+        self.register_handler(PLAYER_STATS, self._parse_stats_update)
+        self.register_handler(UPGRADE, self._parse_upgrade)
+        self.register_handler(UNIT_INIT, self._parse_unit_started)
+        self.register_handler(UNIT_BORN, self._parse_unit_started)
+        self.register_handler(UNIT_DIED, self._parse_unit_removed)
+
+    def _parse_unit_started(self, event: Event):
+        self.tracked_units.add(event)
+        return self._parse_initialize_unit(event)
 
+    def _parse_unit_removed(self, event: Event):
+        init_event = self.tracked_units.fetch(event)
+        if init_event is not None:
+            return self._parse_unit_died(event, init_event)
 
     def add_match_event(self, event: Event, key, description, points=0, value=0, raw=""):
-        from copy import deepcopy
         obj = MatchEvent(
             event=event,
             key=key,
             description=description,
-            profile = deepcopy(self.get_player(event.get('m_controlPlayerId'))),
-            opposing_profile = deepcopy(self.get_player(event.get('m_killerPlayerId'))),
-            player_state = deepcopy(self.players),
+            profile = self.get_player(event.get('m_controlPlayerId')),
+            opposing_profile = self.get_player(event.get('m_killerPlayerId')),
+            player_state = self.players,
             points=points,
             value=value,
             raw=raw
@@ -183,7 +260,7 @@ class Replay:
         -------
         ReplayParseError
         """
-        a, b = closest_version(self.base_build, versions)
+        a, b = self.fallback_versions
 
         try:
             self._parse()
@@ -195,18 +272,64 @@ class Replay:
             # Maybe some protocol error if one was missing. This had defaulted
             # to the higher one, so try the lower one.
             log.info(f"Parse failed. Trying higher version {b}")
-            self.protocol = versions.build(b)
+            self.protocol = self.fallback_protocol
             return self.parse(failed=True)
 
+    def close(self):
+        """
+        Releases the memory map or buffer the archive is read from. Events
+        already decoded stay available.
+        """
+        if self._owns_source:
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def fallback_protocol(self):
+        """
+        The protocol of the next higher build, for when parsing with the
+        resolved protocol failed. Comes from the process wide registry, so
+        asking for it again costs nothing.
+        """
+        return protocols.build(self.fallback_versions[1])
+
     @property
     def game_length(self):
         return self.segments['final'].get('game_time', 0)
 
+    @property
+    def game_length_loops(self) -> int:
+        return self.segments['final'].get('gameloop', 0)
+
+    @property
+    def sync_time(self) -> typing.Optional[int]:
+        """
+        The m_syncTime of the first SSetSyncLoadingTimeEvent. This is both our
+        game id and the match date.
+
+        The event is sent while the game is loading so it sits at the very
+        start of the game events. We stop decoding as soon as we see it and
+        remember the value, so asking again never touches the stream.
+        Returns
+        -------
+        Optional[int]
+        """
+        if not self._sync_time_loaded:
+            for event in self.game_events:
+                if event.time_event:
+                    self._sync_time = event['m_syncTime']
+                    break
+            self._sync_time_loaded = True
+        return self._sync_time
+
     @property
     def game_id(self):
-        for e in self.game_events:
-            if e.get('_event') == 'NNet.Game.SSetSyncLoadingTimeEvent':
-                return e.get('m_syncTime')
+        return self.sync_time
 
 
     def pid_to_positions(self) -> typing.Dict[int, typing.Optional[int]]:
@@ -272,10 +395,29 @@ class Replay:
 
 
     def get_player(self, id: typing.Optional[int], lookup='player_id') -> typing.Optional[Player]:
+        """
+        Finds a (non observer) player by one of its ids. This is called several
+        times for every tracker event so the common lookups are served from the
+        index built in _load_objects.
+        Parameters
+        ----------
+        id: The value to look for
+        lookup: The Player attribute to match on. 'player_id', 'user_id' and
+            'profile_id' are indexed.
+
+        Returns
+        -------
+        Optional[Player]
+        """
+        if self._player_index is None:
+            self._load_objects()
+        index = self._player_index.get(lookup)
+        if index is not None:
+            return index.get(id)
+
         for p in self.players:
-            if hasattr(p, lookup):
-                if getattr(p, lookup)== id:
-                    return p
+            if getattr(p, lookup, None) == id:
+                return p
     @property
     def attribute_events(self):
         if self._attribute_events is None:
@@ -283,42 +425,95 @@ class Replay:
             self._attribute_events = self.protocol.decode_replay_attributes_events(contents)
         return self._attribute_events
 
+    def _stream(self, name: str, wanted_ids: typing.Optional[typing.Set[int]] = None,
+                retain: bool = False) -> DecodedStream:
+        """
+        Returns a decoded stream for the MPQ file. Retained streams are shared,
+        and a new one is only made the first time it is asked for, or if the
+        protocol has been swapped out for a fallback version since.
+        Parameters
+        ----------
+        name: MPQ file name, e.g 'replay.tracker.events'
+        wanted_ids: Only decode the tracker events with these ids. Each
+            distinct set gets its own stream.
+        retain: Share the stream and buffer its events for later readers.
+            Otherwise it keeps no events, is not shared and a new one is made
+            on every call.
+
+        Returns
+        -------
+        DecodedStream
+        """
+        key = name if wanted_ids is None else (name, frozenset(wanted_ids))
+        stream = self._streams.get(key) if retain else None
+        if stream is None or stream.protocol is not self.protocol:
+            cache = self.stream_cache
+            if cache is not None and name in self.CACHED_STREAMS:
+                events = cache.load_or_store(
+                    self.content_digest, self.protocol, entry_name(name, wanted_ids),
+                    lambda: decode_stream(self.archive, name, self.protocol, wanted_ids)
+                )
+                stream = DecodedStream((Event(e) for e in events), protocol=self.protocol, retain=retain)
+            else:
+                stream = DecodedStream.from_archive(self.archive, name, self.protocol, wanted_ids, retain=retain)
+            if retain:
+                self._streams[key] = stream
+        return stream
+
+    @property
+    def content_digest(self) -> str:
+        """sha256 hex digest of the replay file"""
+        if self._content_digest is None:
+            self._content_digest = content_hash(self._source)
+        return self._content_digest
+
+    def _decode_object(self, name: str, decoder: str):
+        def decode():
+            contents = self.archive.read_file(name)
+            return getattr(self.protocol, decoder)(contents)
+        if self.stream_cache is None:
+            return decode()
+        return self.stream_cache.get_object(self.content_digest, self.protocol, name, decode)
+
+    @property
+    def tracker_events(self) -> typing.Iterator[Event]:
+        """
+        Every tracker event. Shared by the lookups at the start of the stream,
+        which each read only as far as the player setup and starting units.
+        """
+        return iter(self._stream('replay.tracker.events', retain=True))
+
     @property
-    def tracker_events(self):
-        if self._tracker_events is None:
-            contents = self.archive.read_file('replay.tracker.events')
-            for event in self.protocol.decode_replay_tracker_events(contents):
-                yield Event(**event)
-        #return self._tracker_events
+    def handled_tracker_events(self) -> typing.Iterator[Event]:
+        """
+        Only the tracker events of a kind some handler is registered for. The
+        rest are skipped while decoding and never become dicts or Events.
+        Not kept for other readers if retain_events is off.
+        """
+        names = [name for name, kind in EVENT_KINDS.items() if kind in self._handlers]
+        wanted_ids = tracker_event_ids(self.protocol, names)
+        return iter(self._stream('replay.tracker.events', wanted_ids, retain=self.retain_events))
+
     @property
     def init_data(self):
         if self._init_data is None:
-            contents = self.archive.read_file('replay.initData')
-            self._init_data = self.protocol.decode_replay_initdata(contents)
+            self._init_data = self._decode_object('replay.initData', 'decode_replay_initdata')
         return self._init_data
 
     @property
     def details(self):
         if self._details is None:
-            contents = self.archive.read_file('replay.details')
-            self._details = self.protocol.decode_replay_details(contents)
+            self._details = self._decode_object('replay.details', 'decode_replay_details')
         return self._details
 
     @property
-    def game_events(self):
-        if self._events is None:
-            contents = self.archive.read_file('replay.game.events')
-            for event in self.protocol.decode_replay_game_events(contents):
-                event = Event(**event)
-                yield event
-
-        return self._events
+    def game_events(self) -> typing.Iterator[Event]:
+        """Shared. Only ever read up to the sync event."""
+        return iter(self._stream('replay.game.events', retain=True))
 
     @property
-    def message_events(self):
-        contents = self.archive.read_file('replay.message.events')
-        for event in self.protocol.decode_replay_message_events(contents):
-            yield Event(**event)
+    def message_events(self) -> typing.Iterator[Event]:
+        return iter(self._stream('replay.message.events'))
 
 
     @property
@@ -328,14 +523,8 @@ class Replay:
 
     @property
     def game_time(self) -> datetime:
-        if self._time is None:
-            # Just get the first one to make this faster:
-            for event in self.game_events:
-                if event.time_event:
-                    self._time = datetime.fromtimestamp(event['m_syncTime'], tz=timezone.utc)
-                    break
-
-
+        if self._time is None and self.sync_time is not None:
+            self._time = datetime.fromtimestamp(self.sync_time, tz=timezone.utc)
         return self._time
 
     def user_id(self, working_set_slot_id: int):
@@ -374,7 +563,7 @@ class Replay:
         return uid_pid_mapping
 
 
-    def _load_objects(self, load_messages=True):
+    def _load_objects(self):
         """
         Relationships are hard work...
         In order to get Player Ids from the game, we have to dig through a
@@ -409,17 +598,6 @@ class Replay:
         -------
         None
         """
-        if load_messages:
-            # Create a lookup for all messageable events so we can get an accurate
-            # snapshot during each segment we want to find.
-            for msg in self.message_events:
-                if msg['_event'] == 'NNet.Game.SChatMessage':
-                    loop = msg['_gameloop']
-                    self._message_lookup[loop] = msg
-            self._message_keys = list(self._message_lookup.keys())
-
-
-
         player_container = {}
         team_container = {}
         name_pattern = re.compile(r'&lt;.*<sp/>')
@@ -431,7 +609,6 @@ class Replay:
         }
         uid_pid_mapping = self.create_uid_pid_mapping()
         pid_position_mapping = self.pid_to_positions()
-        print(pid_position_mapping)
         position_pid_mapping = {v:k for k,v in pid_position_mapping.items()}
 
         for p in self.details.get('m_playerList', []):
@@ -481,27 +658,42 @@ class Replay:
             player_container[player_id] = player
         self._players = list(player_container.values())
         self._teams = list(team_container.values())
+        self._active_teams = [t for t in self._teams if t.position is not None]
+        self._active_players = tuple(p for p in self._players if not p.observer)
+        self._player_dead_count = sum(1 for p in self._active_players if p.is_eliminated)
+        self._team_dead_count = sum(1 for t in self._active_teams if t.is_eliminated)
+        self._teams_remaining = len(self._active_teams) - self._team_dead_count
+        self._team_segments_due = True
+        self._player_index = {key: {} for key in PLAYER_INDEX_KEYS}
+        for player in self._active_players:
+            for key, index in self._player_index.items():
+                # First one wins, just like a scan through the list would.
+                index.setdefault(getattr(player, key), player)
 
 
     @property
-    def players(self) -> typing.List[Player]:
+    def players(self) -> typing.Tuple[Player, ...]:
+        """
+        The non observer players. A tuple, since the player index is built
+        from it once and must not go out of step with it.
+        """
         if not self._players:
             self._load_objects()
-        return [p for p in self._players if not p.observer]
+        return self._active_players
 
     @property
     def player_dead_count(self):
-        return sum(1 for p in self.players if p.left_game or p.eliminated)
+        return self._player_dead_count
 
     @property
     def team_dead_count(self):
-        return sum(1 for t in self.teams if t.is_eliminated)
+        return self._team_dead_count
 
     @property
     def teams(self) -> typing.Optional[typing.List[Team]]:
         if self._teams is None:
             self._load_objects()
-        return [t for t in self._teams if t.position is not None]
+        return self._active_teams
 
     def winning_team(self) -> typing.Optional[int]:
         for t in self.teams:
@@ -514,16 +706,40 @@ class Replay:
 
     @property
     def teams_remaining(self) -> int:
-        return sum(1 for t in self.teams if not t.is_eliminated)
+        return self._teams_remaining
 
+    def remaining_team(self) -> typing.Optional[Team]:
+        """The last team standing, once only one is left."""
+        if self._teams_remaining != 1:
+            return
+        for t in self.teams:
+            if not t.is_eliminated:
+                return t
+
+    def _mark_eliminated(self, player: Player, left_game: bool):
+        """
+        Flags the player as out and updates the dead and remaining counts. Every
+        elimination has to go through here.
+        """
+        was_eliminated = player.is_eliminated
+        team_was_eliminated = player.team is not None and player.team.is_eliminated
+        player.left_game = left_game
+        player.eliminated = not left_game
+        if not was_eliminated and not player.observer:
+            self._player_dead_count += 1
+        team = player.team
+        if team_was_eliminated or team is None or team.position is None or not team.is_eliminated:
+            return
+        self._team_dead_count += 1
+        self._teams_remaining -= 1
+        self._team_segments_due = True
 
     def eliminate_player(self, event, player: Player, killer: typing.Optional[Player]):
         player.victim_number = self.player_dead_count + 1
 
-        player.left_game = killer is None
-        player.eliminated = not player.left_game
+        self._mark_eliminated(player, left_game=killer is None)
         player.killer = killer
-        player.eliminated_at = event.game_time
+        player.eliminated_at_loop = event.gameloop
 
         key = "player_leave"
         description = f"{player.name} has left the game."
@@ -538,9 +754,9 @@ class Replay:
             # They already won. Suppress any match event from them leaving.
             self.add_match_event(event, key, description)
         # Check for a win condition and set it on the player class
-        remaining_teams = [t for t in self.teams if not t.is_eliminated]
-        if len(remaining_teams) == 1:
-            for p in remaining_teams[0].players:
+        remaining_team = self.remaining_team()
+        if remaining_team is not None:
+            for p in remaining_team.players:
                 if not p.left_game:
                     p.winner = True
 
@@ -565,8 +781,8 @@ class Replay:
         """
 
         xfer_unit_init = self.tracked_units.fetch(event)
-        unit_name = xfer_unit_init['m_unitTypeName']
-        player = self.get_player(xfer_unit_init['m_controlPlayerId'])
+        unit_name = xfer_unit_init.unit
+        player = self.get_player(xfer_unit_init.owner_id)
         # Make sure the game isn't already over. Don't transfer units if the game
         # has ended.
         if player is not None and player.winner:
@@ -585,9 +801,7 @@ class Replay:
         new_owner = self.get_player(event['m_controlPlayerId'])
 
         player.unit_stats.transfer(new_owner, unit_name)
-        xfer_unit_init['m_controlPlayerId'] = new_owner.player_id
-        xfer_unit_init['m_upkeepPlayerId'] = new_owner.player_id
-        self.tracked_units.add(xfer_unit_init)
+        self.tracked_units.transfer(event, new_owner.player_id)
 
         if player.has_no_bunkers and not player.is_eliminated:
             self.eliminate_player(event, player, None)
@@ -705,7 +919,7 @@ class Replay:
         -------
         None
         """
-        owner = self.get_player(init_event['m_controlPlayerId'])
+        owner = self.get_player(init_event.owner_id)
         killer = self.get_player(event.get('m_killerPlayerId'))
 
         if owner is None:
@@ -802,35 +1016,21 @@ class Replay:
 
 
 
-    def _parse_chat_messages(self, event: Event):
+    def _parse_chat_message(self, event: Event):
         """
-        Parses any chat message event that comes through. We capture stats mainly
-        on the number of all chats that go through. We wont' fire off events
-        necessarily for allied chats, although it'll be loaded into the Profile
-        object.
+        Parses a chat message event. We capture stats mainly on the number of
+        all chats that go through. We wont' fire off events necessarily for
+        allied chats, although it'll be loaded into the Profile object.
 
-        This function acts differently since it is seperate from the main tracker
-        events iteration. It's relatively smaller so we load it into memory by
-        gameloop as a key. This function will get called and we'll track if the
-        tracker loop is greater than the next expected loop from this one.
+        Chat messages come from the message stream, which _parse merges into
+        the tracker events by game loop, so each one is seen exactly once and
+        in order.
         Returns
         -------
 
         """
-        try:
-            next_id = self._message_keys[0]
-        except IndexError:
-            return
-
-        if event['_gameloop'] < next_id:
-            return
-
-        # Load the new event we need
-        event = self._message_lookup[next_id]
-
         recipient_id = event['m_recipient']
         owner_id = event['_userid']['m_userId']
-        chat_type = "All Chat" if recipient_id == 0 else "Allied Chat"
         owner = self.get_player(owner_id, 'user_id')
         recipient = self.get_player(recipient_id, 'user_id')
         if owner is not None:
@@ -844,81 +1044,81 @@ class Replay:
                 owner.all_chats.append(payload)
             else:
                 owner.allied_chats.append(payload)
-        self._message_keys.pop(0)
+
+    @property
+    def chat_messages(self) -> typing.Iterator[Event]:
+        """Chat messages only, from the shared message stream"""
+        return (e for e in self.message_events if e.kind == CHAT_MESSAGE)
+
+    def merged_events(self, events: typing.Iterable[Event]) -> typing.Iterator[Event]:
+        """
+        Merges the chat messages into events by game loop. A message goes
+        before the events on its own loop. Both streams are already in order,
+        so this is a lazy k-way merge and neither is read ahead of the other.
+        """
+        return heapq.merge(self.chat_messages, events, key=_gameloop)
+
+    def _take_segment(self, key: str, event: Event):
+        self.segments[key]['gameloop'] = event.gameloop
+        self.segments[key]['game_time'] = event.game_time
+        self.segments[key]['players'] = [p.snapshot() for p in self.players]
 
     def _parse_check_for_segments(self, event: Event):
 
         # Check for "Early Segment"
-        if len(self.segments['early']) == 0 and float(event.game_time) > 480:  # 8m
-            self.segments['early']['game_time'] = event.game_time
-            self.segments['early']['players'] = deepcopy(self.players)
+        if len(self.segments['early']) == 0 and event.gameloop > utils.EARLY_SEGMENT_GAMELOOP:  # 8m
+            self._take_segment('early', event)
             self.segments['early']['valid'] = True
 
+        if not self._team_segments_due:
+            return
+        # Team counts only change on an elimination. The first event handled
+        # also checks them, for games that start with few teams.
+        self._team_segments_due = False
+
         if len(self.segments['three_teams']) == 0 and self.teams_remaining <= 3:
-            self.segments['three_teams']['game_time'] = event.game_time
-            self.segments['three_teams']['players'] = deepcopy(self.players)
+            self._take_segment('three_teams', event)
             # Check if this is a valid measurement
             self.segments['three_teams']['valid'] = len(self.teams) > 3
 
         if len(self.segments['two_teams']) == 0 and self.teams_remaining <= 2:
-            self.segments['two_teams']['game_time'] = event.game_time
-            self.segments['two_teams']['players'] = deepcopy(self.players)
+            self._take_segment('two_teams', event)
             # Check if this is a valid measurement
             self.segments['two_teams']['valid'] = len(self.teams) > 2
 
         if len(self.segments['final']) == 0 and self.teams_remaining <= 1:
-            self.segments['final']['game_time'] = event.game_time
-            self.segments['final']['players'] = deepcopy(self.players)
+            self._take_segment('final', event)
             # Check if this is a valid measurement
             self.segments['final']['valid'] = len(self.teams) > 1
 
             # Fulfill Early if not done
             if len(self.segments['early']) == 0:
-                self.segments['early']['game_time'] = event.game_time
-                self.segments['early']['players'] = deepcopy(self.players)
+                self._take_segment('early', event)
                 self.segments['early']['valid'] = False
 
 
 
     def _segment_check_team(self, event, key, target) -> bool:
-        eliminated_teams = sum(1 for t in self.teams if t.is_eliminated)
-        if len(self.teams) - eliminated_teams == target:
-            self.segments[key]['game_time'] = event.game_time
-            self.segments[key]['players'] = deepcopy(self.players)
+        if self.teams_remaining == target:
+            self._take_segment(key, event)
             return True
         return False
 
     def _parse(self):
-        i = 0
         log.info(f"{self.game_id} - Parsing Game")
         self.units = []
-        for event in self.tracker_events:
-            self._parse_chat_messages(event)
-            init_event = self.tracked_units.fetch(event)
-
-
-
-            #if event.unit_type_changed:
-            #    utype = event['m_unitTypeName']
-            #    unit = self.tracked_units.fetch(event)
-            #    if unit.is_unit('SupplyDepot'):
-            #        log.critical(f" {utype} on {unit}")
-
-            if event.unit_owner_transferred:
-                self._parse_transferred(event)
-
-            if event.stats_update:
-                self._parse_stats_update(event)
-
-            if event.upgrade_event:
-                self._parse_upgrade(event)
-
-            if event.unit_init or event.unit_born:
-                self.tracked_units.add(event)
-                self._parse_initialize_unit(event)
-
-            if event.unit_died and init_event is not None:
-                self._parse_unit_died(event, init_event)
+        handlers = self._handlers
+        for event in self.merged_events(self.handled_tracker_events):
+            if event.kind == CHAT_MESSAGE:
+                self._parse_chat_message(event)
+                continue
+            event_handlers = handlers.get(event.kind)
+            if event_handlers is None:
+                # Nothing we track changes on events nobody subscribed to.
+                continue
+
+            for handler in event_handlers:
+                handler(event)
 
             self._parse_check_for_segments(event)
         log.info(f"{self.game_id} - Parsing Complete")
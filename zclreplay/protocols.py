@@ -0,0 +1,138 @@
+"""
+Process wide registry of s2protocol protocol modules.
+
+s2protocol looks protocols up by scanning its versions directory and
+importing by file path. Doing that for every replay, and again for every
+fallback or retry, adds up in the workers. Everything here is resolved once
+per process and handed out from memory afterwards, including builds that turned
+out to be missing.
+
+Workers can call preload() before forking so that every child starts with the
+common builds already imported.
+"""
+import bisect
+import logging
+import re
+import threading
+import typing
+
+from s2protocol import versions
+
+log = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_builds: typing.Optional[typing.List[int]] = None
+_modules: typing.Dict[int, typing.Any] = {}
+_missing: typing.Set[int] = set()
+_closest: typing.Dict[int, typing.Tuple[int, int]] = {}
+
+
+def available_builds() -> typing.List[int]:
+    """Every build s2protocol ships a protocol for, oldest first."""
+    global _builds
+    if _builds is None:
+        with _lock:
+            if _builds is None:
+                _builds = sorted(int(b) for b in re.findall('\\d+', ''.join(versions.list_all())))
+    return _builds
+
+
+def build(base_build: int):
+    """
+    The protocol module for base_build. Same as versions.build, but each build
+    is imported at most once per process.
+
+    Raises
+    ------
+    ImportError: s2protocol has no protocol for base_build
+    """
+    protocol = _modules.get(base_build)
+    if protocol is not None:
+        return protocol
+    if base_build in _missing:
+        raise ImportError(f"No s2protocol protocol for build {base_build}")
+    with _lock:
+        if base_build not in _modules:
+            try:
+                _modules[base_build] = versions.build(base_build)
+            except ImportError:
+                _missing.add(base_build)
+                raise
+        return _modules[base_build]
+
+
+def build_number(protocol) -> int:
+    """The base build a protocol module is for, e.g 80949 for protocol80949."""
+    return int(protocol.__name__.rsplit('protocol', 1)[-1])
+
+
+def latest():
+    """The protocol module of the newest build."""
+    return build(available_builds()[-1])
+
+
+def closest_builds(base_build: int) -> typing.Tuple[int, int]:
+    """
+    s2protocol may be missing a particular protocol. Finds the nearest lower
+    and the nearest higher (or same) builds we have a protocol for. Memoized.
+    Parameters
+    ----------
+    base_build: m_baseBuild of the replay
+
+    Returns
+    -------
+    Tuple[int, int] of the lower and higher build. The higher one is
+    base_build itself if there is nothing newer.
+    """
+    result = _closest.get(base_build)
+    if result is None:
+        builds = available_builds()
+        index = bisect.bisect_left(builds, base_build)
+        lower = builds[max(index - 1, 0)]
+        higher = builds[index] if index < len(builds) else base_build
+        result = _closest[base_build] = (lower, higher)
+    return result
+
+
+def resolve(base_build: int):
+    """
+    The protocol module to decode a replay of base_build with. Falls back to
+    the next lower build when s2protocol doesn't have it.
+    """
+    try:
+        return build(base_build)
+    except ImportError:
+        next_lower = closest_builds(base_build)[0]
+        log.info(f"Missing Protocol {base_build}. Using Next Lower {next_lower}")
+        return build(next_lower)
+
+
+def preload(builds: typing.Iterable[int] = (), newest: int = 0) -> typing.List[int]:
+    """
+    Imports protocol modules ahead of time. Call it in the parent process
+    before the workers fork.
+    Parameters
+    ----------
+    builds: Specific base builds to load
+    newest: Also load this many of the newest builds
+
+    Returns
+    -------
+    List[int] of the builds that are now loaded
+    """
+    wanted = list(builds)
+    if newest:
+        wanted += available_builds()[-newest:]
+    loaded = []
+    for base_build in wanted:
+        try:
+            build(base_build)
+            loaded.append(base_build)
+        except ImportError:
+            log.warning(f"Cannot preload protocol {base_build}. s2protocol doesn't have it.")
+    log.debug(f"Preloaded protocols {loaded}")
+    return loaded
+
+
+def loaded_builds() -> typing.List[int]:
+    return sorted(_modules)
@@ -0,0 +1,350 @@
+"""
+Recorded parse results and a content addressed cache for them.
+
+A ParseResult is everything the database import needs from a StreamParser
+run: the stream items that carry a payload, with the players frozen as of
+that item, and the end of game rosters, teams, stats and messages. It holds
+no reference to the parser or the archive and pickles, so it can be cached
+and fed back in place of parsing again.
+
+Results are cached by the sha256 of the replay file, the protocol build it
+was decoded with and PARSER_VERSION. Bump PARSER_VERSION whenever a parser
+change would produce different results or change what a ParseResult holds,
+so that stale entries stop matching.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+import typing
+
+from .objects import PlayerState, MessageEvent, freeze_player
+from .sources import open_source
+from . import protocols
+from . import utils
+
+log = logging.getLogger(__name__)
+
+# 2: complete and timeline attributes, chat kept out of the items, and the
+#    elimination counters behind the segments
+PARSER_VERSION = 2
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def content_hash(source) -> str:
+    """
+    sha256 hex digest of a replay file's contents. Accepts anything Replay
+    does. The position of a file passed in is left as it was.
+    """
+    f = open_source(source)
+    position = f.tell()
+    digest = hashlib.sha256()
+    try:
+        f.seek(0)
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    finally:
+        if f is source:
+            f.seek(position)
+        else:
+            f.close()
+    return digest.hexdigest()
+
+
+def cache_key(digest: str, protocol_build: int) -> str:
+    """
+    Parameters
+    ----------
+    digest: content_hash of the replay
+    protocol_build: Build of the protocol the result was decoded with
+    """
+    return f"zclreplay-{PARSER_VERSION}-{protocol_build}-{digest}"
+
+
+def cache_keys(digest: str, base_build: int) -> typing.List[str]:
+    """
+    Every key a result for the replay may be under, in the order we would
+    parse it: decoded with the protocol resolved for its build, then with the
+    higher fallback one.
+    """
+    primary = protocols.build_number(protocols.resolve(base_build))
+    fallback = protocols.closest_builds(base_build)[1]
+    return [cache_key(digest, build) for build in dict.fromkeys((primary, fallback))]
+
+
+def cached_result(cache, digest: str, base_build: int) -> typing.Optional['ParseResult']:
+    """
+    The cached result for the replay, if any.
+    Parameters
+    ----------
+    cache: FileResultCache, or anything with the same get
+    digest: content_hash of the replay
+    base_build: Replay.read_base_build of the replay
+    """
+    for key in cache_keys(digest, base_build):
+        result = cache.get(key)
+        if result is None:
+            continue
+        if getattr(result, 'parser_version', None) != PARSER_VERSION:
+            # Should not happen with the version in the key, but a pickle of
+            # an older ParseResult would be missing attributes.
+            log.warning(f"Ignoring cached result {key} of parser version {getattr(result, 'parser_version', None)}")
+            continue
+        return result
+
+
+def store_result(cache, digest: str, result: 'ParseResult'):
+    cache.set(cache_key(digest, result.protocol_build), result)
+
+
+class RecordedItem(typing.NamedTuple):
+    """A StreamItem with a payload, and the players as they were at that point."""
+    gameloop: int
+    payload: typing.Any
+    players: typing.Tuple[PlayerState, ...]
+
+    @property
+    def game_time(self) -> str:
+        return utils.game_time(self.gameloop)
+
+
+class TeamResult(typing.NamedTuple):
+    id: int
+    position: int
+    winner: bool
+    profile_ids: typing.Tuple[str, ...]
+
+
+class ParseResult:
+    def __init__(self, game_id: int, game_time: datetime.datetime, game_loop: int,
+                 items: typing.List[RecordedItem], players: typing.List[PlayerState],
+                 teams: typing.List[TeamResult], feeds: typing.Dict[str, typing.Dict[str, typing.Any]],
+                 unit_stats: typing.List[typing.Dict[str, typing.Any]], messages: typing.List[MessageEvent]):
+        self.parser_version = PARSER_VERSION
+        # Build of the protocol module the replay was decoded with
+        self.protocol_build: typing.Optional[int] = None
+        # False for summaries, which stop once the game is decided
+        self.complete = True
+        # zclreplay.timeline.Timeline, if the parser tracked one
+        self.timeline = None
+        self.game_id = game_id
+        self.game_time = game_time
+        self.game_loop = game_loop
+        self.items = items
+        self.players = players
+        self.teams = teams
+        self.feeds = feeds
+        self.unit_stats = unit_stats
+        self.messages = messages
+
+    @classmethod
+    def record(cls, replay, items: typing.Optional[typing.Iterable] = None) -> 'ParseResult':
+        """
+        Runs a StreamParser to the end and records what it produced.
+        Parameters
+        ----------
+        replay: zclreplay.streamparser.StreamParser
+        items: The StreamItems to record. Defaults to replay._parse(). Pass
+            replay.parse_until(...) to record only part of the game; the
+            result is then marked incomplete.
+
+        Returns
+        -------
+        ParseResult
+        """
+        if items is None:
+            items = replay._parse()
+        recorded = []
+        messages = []
+        for item in items:
+            payload = item.payload
+            if payload is None:
+                continue
+            if isinstance(payload, MessageEvent):
+                # Chat is merged into the stream. Kept apart so a partial
+                # parse only has the messages up to where it stopped.
+                messages.append(MessageEvent(freeze_player(payload.profile), payload.gameloop,
+                                             payload.message_type, payload.message))
+                continue
+            players = tuple(p.snapshot() for p in item.state.players)
+            recorded.append(RecordedItem(item.event.gameloop, payload, players))
+
+        return cls._from_replay(
+            replay,
+            items=recorded,
+            feeds={p.profile_id: p.feed for p in replay.players},
+            unit_stats=replay.unit_stats(),
+            messages=messages,
+        )
+
+    @classmethod
+    def record_summary(cls, replay) -> 'ParseResult':
+        """
+        Runs a StreamParser only until the game is decided and records the
+        rosters, teams, results and game length. There are no items, feeds,
+        unit stats or messages.
+        """
+        for _ in replay.summarize():
+            pass
+        return cls._from_replay(replay, items=[], feeds={}, unit_stats=[], messages=[], complete=False)
+
+    @classmethod
+    def _from_replay(cls, replay, complete: typing.Optional[bool] = None, **kwargs) -> 'ParseResult':
+        result = cls(
+            game_id=replay.game_id,
+            game_time=replay.game_time,
+            game_loop=replay.game_length_loops,
+            players=[p.snapshot() for p in replay.players],
+            teams=[
+                TeamResult(t.id, t.position, t.winner, tuple(p.profile_id for p in t.players))
+                for t in replay.teams
+            ],
+            **kwargs
+        )
+        result.complete = not replay.partial if complete is None else complete
+        result.timeline = replay.timeline
+        result.protocol_build = protocols.build_number(replay.protocol)
+        return result
+
+    def state_at(self, gameloop: int) -> typing.Tuple[PlayerState, ...]:
+        """See StreamParser.state_at"""
+        if self.timeline is None:
+            raise ValueError("No timeline was recorded for this result")
+        return self.timeline.state_at(gameloop)
+
+    def profile_ids(self) -> typing.Set[str]:
+        """
+        Every profile id the result refers to: players, lanes, killers, match
+        event profiles and message senders.
+        """
+        ids = set()
+        for p in self.players:
+            ids.update((p.profile_id, p.lane_id, p.killer_id))
+        for item in self.items:
+            payload = item.payload
+            for profile in (getattr(payload, 'profile', None), getattr(payload, 'opposing_profile', None)):
+                if profile is not None:
+                    ids.add(profile.profile_id)
+            for p in item.players:
+                ids.update((p.profile_id, p.lane_id, p.killer_id))
+        for m in self.messages:
+            if m.profile is not None:
+                ids.add(m.profile.profile_id)
+        ids.discard(None)
+        return ids
+
+    def get_player(self, profile_id: str) -> typing.Optional[PlayerState]:
+        for p in self.players:
+            if p.profile_id == profile_id:
+                return p
+
+    def team_players(self, team: TeamResult) -> typing.List[PlayerState]:
+        return [self.get_player(profile_id) for profile_id in team.profile_ids]
+
+
+class FileResultCache:
+    """
+    Pickled ParseResults in a local directory, one file per key. Entries older
+    than max_age seconds are dropped, and the least recently used ones once
+    the directory grows past max_bytes.
+    """
+    SUFFIX = '.pickle'
+
+    def __init__(self, directory: str, max_bytes: typing.Optional[int] = None,
+                 max_age: typing.Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _expired(self, mtime: float, now: float) -> bool:
+        return self.max_age is not None and now - mtime > self.max_age
+
+    def get(self, key: str) -> typing.Optional[ParseResult]:
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if self._expired(mtime, time.time()):
+                os.remove(path)
+                return
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            # Mark it as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log.warning(f"Dropping unreadable cached result {key}: {e}")
+            self.delete(key)
+            return
+        return result
+
+    def set(self, key: str, result: ParseResult):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        evict_files(self.directory, self.SUFFIX, max_bytes=self.max_bytes, max_age=self.max_age)
+
+
+def evict_files(directory: str, suffix: str, max_bytes: typing.Optional[int] = None,
+                max_age: typing.Optional[int] = None):
+    """
+    Removes the files ending in suffix from directory that are older than
+    max_age seconds, then the least recently modified ones until the rest fit
+    in max_bytes.
+    """
+    now = time.time()
+    entries = []
+    try:
+        it = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with it:
+        for entry in it:
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if max_age is not None and now - stat.st_mtime > max_age:
+                _remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    if max_bytes is None:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,128 @@
+"""
+Turns whatever we were handed as a replay into something mpyq can read from
+without first pulling the whole archive into memory.
+
+mpyq only ever seeks to and reads the blocks of the files it is asked for. Paths
+are memory mapped, so those blocks are paged in by the OS and shared between
+processes reading the same file. Bytes and buffers are wrapped without being
+copied.
+"""
+import io
+import logging
+import mmap
+import os
+import typing
+
+log = logging.getLogger(__name__)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    A read only, seekable file over a buffer. Reads copy out only the bytes
+    asked for; the buffer itself is never copied.
+    """
+
+    def __init__(self, buffer, owner=None):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._owner = owner
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        # The view has to go before the mmap or BytesIO it exports from
+        # can be closed or resized.
+        self._view.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+        super().close()
+
+
+def _map_file(f) -> typing.Optional[BufferReader]:
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Not backed by a real file, or empty
+        return None
+    return BufferReader(mapped, owner=mapped)
+
+
+def open_source(source) -> typing.BinaryIO:
+    """
+    A seekable binary file over a replay source for mpyq.MPQArchive.
+    Parameters
+    ----------
+    source: A path, bytes-like object or memoryview, io.BytesIO, an open file,
+        or a Django File/FieldFile
+
+    Returns
+    -------
+    File-like object. Close it when done with the replay to release the mapping.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            mapped = _map_file(f)
+        if mapped is not None:
+            return mapped
+        # mmap can't map empty files. Let mpyq fail on it as it would have.
+        return open(source, 'rb')
+
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return BufferReader(source)
+
+    if isinstance(source, io.BytesIO):
+        return BufferReader(source.getbuffer())
+
+    # Django File objects wrap the real file. Uploads in memory hold a BytesIO,
+    # anything spooled to disk a real file we can map.
+    inner = getattr(source, 'file', None)
+    if inner is not None and inner is not source and hasattr(inner, 'read'):
+        if isinstance(inner, io.BytesIO):
+            return BufferReader(inner.getbuffer())
+        mapped = _map_file(inner)
+        if mapped is not None:
+            return mapped
+
+    mapped = _map_file(source)
+    if mapped is not None:
+        return mapped
+    # Some other file-like (remote storage). mpyq reads it block by block.
+    return source
@@ -0,0 +1,157 @@
+"""
+On disk cache of the raw s2protocol decode of a replay.
+
+Decoding the archive is the slowest part of a parse. When only our own
+handlers change, the decoded streams are the same as last time, so they are
+kept here and read back instead. Entries are keyed by the replay's content
+hash and the protocol module that decoded them. Tracker events filtered down
+to a set of event ids get an entry per set, see entry_name(), so a cached read
+costs no more than the filtered decode it replaces.
+
+A missing entry is written while its first reader decodes, and only appears
+once a reader gets to the end. A reader that stops early, like a summary,
+decodes no further than it reads and leaves nothing behind.
+
+Each entry is a gzip file of length prefixed records, one per decoded event
+(or a single record for details and initData), marshalled as s2protocol
+returned them. marshal is fast, handles every type s2protocol produces and
+needs nothing outside the standard library, but its format belongs to the
+running Python, so the Python version is part of the key as well.
+
+Turn it on for every Replay with
+
+    Replay.stream_cache = StreamCache('/var/cache/zclreplay/streams')
+"""
+import gzip
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import sys
+import tempfile
+import typing
+
+from .results import evict_files
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'ZCLS\x01'
+LENGTH = struct.Struct('<I')
+FORMAT_TAG = f"py{sys.version_info[0]}{sys.version_info[1]}m{marshal.version}"
+
+
+def entry_name(name: str, wanted_ids: typing.Optional[typing.Iterable[int]] = None) -> str:
+    """Entry name of a member, or of only the events with wanted_ids in it."""
+    if wanted_ids is None:
+        return name
+    ids = ','.join(map(str, sorted(wanted_ids)))
+    return f"{name}.{hashlib.sha1(ids.encode()).hexdigest()[:12]}"
+
+
+def write_records(f, records: typing.Iterable[typing.Any]) -> typing.Iterator[typing.Any]:
+    """Writes each record to f as it is yielded back to the caller."""
+    f.write(MAGIC)
+    for record in records:
+        data = marshal.dumps(record)
+        f.write(LENGTH.pack(len(data)))
+        f.write(data)
+        yield record
+
+
+def read_records(f) -> typing.Iterator[typing.Any]:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a stream cache file")
+    size = LENGTH.size
+    while True:
+        header = f.read(size)
+        if not header:
+            return
+        if len(header) != size:
+            raise EOFError("Truncated stream cache record")
+        (length,) = LENGTH.unpack(header)
+        data = f.read(length)
+        if len(data) != length:
+            raise EOFError("Truncated stream cache record")
+        yield marshal.loads(data)
+
+
+class StreamCache:
+    """
+    Parameters
+    ----------
+    directory: Where to keep the entries
+    max_bytes: Least recently written entries are removed past this size
+    compresslevel: gzip level of new entries. Low levels keep writing cheap.
+    """
+    SUFFIX = '.zcls'
+
+    def __init__(self, directory: str, max_bytes: typing.Optional[int] = None, compresslevel: int = 1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+
+    def path(self, digest: str, protocol, name: str) -> str:
+        build = protocol.__name__.rsplit('.', 1)[-1]
+        return os.path.join(self.directory, f"{digest}-{build}-{FORMAT_TAG}-{name}{self.SUFFIX}")
+
+    def load(self, digest: str, protocol, name: str) -> typing.Optional[typing.Iterator[typing.Any]]:
+        """
+        Iterator over the cached records, or None if there is no entry. An
+        entry that turns out to be damaged is removed and raises while being
+        read.
+        """
+        path = self.path(digest, protocol, name)
+        try:
+            f = gzip.open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        return self._read(f, path)
+
+    def _read(self, f, path: str) -> typing.Iterator[typing.Any]:
+        try:
+            with f:
+                yield from read_records(f)
+        except (OSError, EOFError, ValueError) as e:
+            log.warning(f"Removing damaged stream cache entry {path}: {e}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def store(self, digest: str, protocol, name: str, records: typing.Iterable[typing.Any]) -> typing.Iterator[typing.Any]:
+        """
+        Passes records through while writing them to the cache. The entry only
+        appears once records have been read to the end, so a reader that stops
+        early leaves nothing behind.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compresslevel) as f:
+                yield from write_records(f, records)
+            os.replace(tmp_path, self.path(digest, protocol, name))
+            complete = True
+        finally:
+            if not complete:
+                os.remove(tmp_path)
+        evict_files(self.directory, self.SUFFIX, max_bytes=self.max_bytes)
+
+    def load_or_store(self, digest: str, protocol, name: str,
+                      decode: typing.Callable[[], typing.Iterable[typing.Any]]) -> typing.Iterator[typing.Any]:
+        """
+        Iterator over the records of the entry. On a miss it is over decode()
+        instead, and the entry is written as it goes. Nothing is decoded ahead
+        of the reader.
+        """
+        records = self.load(digest, protocol, name)
+        if records is None:
+            records = self.store(digest, protocol, name, decode())
+        return records
+
+    def get_object(self, digest: str, protocol, name: str, decode: typing.Callable[[], typing.Any]) -> typing.Any:
+        """For the streams that decode to a single object, like replay.details."""
+        records = list(self.load_or_store(digest, protocol, name, lambda: [decode()]))
+        return records[0]
@@ -1,5 +1,7 @@
 from . import Replay, utils
-from .objects import MatchEvent, Event, Player, StreamItem, SegmentEvent, UpgradeEvent, MessageEvent
+from .objects import MatchEvent, Event, Player, StreamItem, SegmentEvent, UpgradeEvent, MessageEvent, PlayerState, CHAT_MESSAGE
+from .objects import CompactTrackedUnits
+from .timeline import Timeline, TimelineRecorder, DEFAULT_CHECKPOINT_INTERVAL
 import logging
 import typing
 from time import sleep
@@ -10,23 +12,72 @@ log = logging.getLogger('zclreplay.streamparser')
 
 
 class StreamParser(Replay):
-
-    def __init__(self, path):
-        super(StreamParser, self).__init__(path)
-        self._load_objects(load_messages=False)
+    """
+    Parameters
+    ----------
+    path: Anything Replay accepts
+    streaming: Keep memory flat for a single pass over the replay. Tracked
+        units only keep their owner, type and tag. Iterate the parser once.
+    digest: See Replay
+    """
+
+    def __init__(self, path, streaming: bool = False, digest: typing.Optional[str] = None):
+        super(StreamParser, self).__init__(path, digest=digest)
+        self.streaming = streaming
+        if streaming:
+            self.tracked_units = CompactTrackedUnits()
         self._container = []
-        self.stream_game_length = 0
+        self.stream_game_loop = 0
+        # Loop of the last tracker event handled
+        self.parsed_game_loop = 0
+        # Set when parse_until stopped before the end of the replay
+        self.stopped_at_loop: typing.Optional[int] = None
+        # See track_timeline()
+        self.timeline: typing.Optional[Timeline] = None
+        self._timeline_recorder: typing.Optional[TimelineRecorder] = None
         self.stream_segments = {
             'early': None,
             'three_teams': None,
             'two_teams': None,
             'final': None,
         }
-        self._load_objects()
+        try:
+            self._load_objects()
+        except BaseException:
+            self.close()
+            raise
 
     def __iter__(self):
         return iter(self.parse())
 
+    @property
+    def stream_game_length(self) -> str:
+        return utils.game_time(self.stream_game_loop)
+
+    @property
+    def partial(self) -> bool:
+        """True if parse_until stopped before the end of the replay"""
+        return self.stopped_at_loop is not None
+
+    @property
+    def game_length_loops(self) -> int:
+        """
+        The loop the game was decided at. If parsing stopped before that, only
+        as far as it got. Check partial.
+        """
+        if self.stream_segments['final'] is not None:
+            return self.stream_game_loop
+        return self.parsed_game_loop
+
+    @property
+    def game_length(self) -> str:
+        return utils.game_time(self.game_length_loops)
+
+    @property
+    def pending_segments(self) -> typing.List[str]:
+        """Segments not reached yet. After a partial parse they may still come."""
+        return [key for key, item in self.stream_segments.items() if item is None]
+
     def add_match_event(self, event: Event, key, description, points=0, value=0, raw=""):
 
         obj = MatchEvent(
@@ -116,6 +167,7 @@ class StreamParser(Replay):
             player.nuke_event = None
 
         player.unit_stats.stat_event = event
+        self._touch(player)
         return result
 
     def _parse_upgrade(self, event):
@@ -139,7 +191,9 @@ class StreamParser(Replay):
             if upgrade_name.startswith('Reward'):
                 return
             new_count = player.upgrade_totals.get(upgrade_name, 0) + count
-            player.upgrade_totals[upgrade_name] = new_count
+            # Replace rather than mutate. Earlier snapshots share the old dict.
+            player.upgrade_totals = {**player.upgrade_totals, upgrade_name: new_count}
+            self._touch(player)
             result = UpgradeEvent()
         return result
 
@@ -175,7 +229,7 @@ class StreamParser(Replay):
         -------
         None
         """
-        owner = self.get_player(init_event['m_controlPlayerId'])
+        owner = self.get_player(init_event.owner_id)
         killer = self.get_player(event.get('m_killerPlayerId'))
         result = []
         tank = False
@@ -291,10 +345,10 @@ class StreamParser(Replay):
         result = None
         player.victim_number = self.player_dead_count + 1
 
-        player.left_game = killer is None
-        player.eliminated = not player.left_game
+        self._mark_eliminated(player, left_game=killer is None)
         player.killer = killer
-        player.eliminated_at = event.game_time
+        player.eliminated_at_loop = event.gameloop
+        self._touch(player)
         if player.team.is_eliminated:
             player.team.victim_number = self.team_dead_count
 
@@ -311,11 +365,12 @@ class StreamParser(Replay):
             # They already won. Suppress any match event from them leaving.
             result = self.add_match_event(event, key, description)
         # Check for a win condition and set it on the player class
-        remaining_teams = [t for t in self.teams if not t.is_eliminated]
-        if len(remaining_teams) == 1:
-            for p in remaining_teams[0].players:
+        remaining_team = self.remaining_team()
+        if remaining_team is not None:
+            for p in remaining_team.players:
                 if not p.left_game:
                     p.winner = True
+                    self._touch(p)
 
         log.debug(description)
         return result
@@ -326,105 +381,205 @@ class StreamParser(Replay):
         state = stream_item.state
         result = []
         # Check for "Early Segment"
-        if self.stream_segments['early'] is None and float(event.game_time) > 480:  # 8m
-            item = StreamItem(event, state=self, payload=SegmentEvent(key='early', valid=True))
-            result.append(item)
-            self.stream_segments['early'] = item
-
+        if self.stream_segments['early'] is None and event.gameloop > utils.EARLY_SEGMENT_GAMELOOP:  # 8m
+            result.append(self._segment_item('early', event, valid=True))
 
+        if not self._team_segments_due:
+            return result
+        # Team counts only change on an elimination. The first event handled
+        # also checks them, for games that start with few teams.
+        self._team_segments_due = False
 
         if self.stream_segments['three_teams'] is None and state.teams_remaining <= 3:
             # Check if this is a valid measurement
             valid = len(self.teams) > 3
-            item = StreamItem(event, state=self, payload=SegmentEvent(key='three_teams', valid=valid))
-            result.append(item)
-            self.stream_segments['three_teams'] = item
+            result.append(self._segment_item('three_teams', event, valid))
 
 
         if self.stream_segments['two_teams'] is None and state.teams_remaining <= 2:
             # Check if this is a valid measurement
             valid = len(self.teams) > 2
-            item = StreamItem(event, state=self, payload=SegmentEvent(key='two_teams', valid=valid))
-            result.append(item)
-            self.stream_segments['two_teams'] = item
+            result.append(self._segment_item('two_teams', event, valid))
 
         if self.stream_segments['final'] is None and state.teams_remaining <= 1:
             # Check if this is a valid measurement
             valid = len(self.teams) > 1
-            item = StreamItem(event, state=self, payload=SegmentEvent(key='final', valid=valid))
-            result.append(item)
-            self.stream_segments['final'] = item
-            self.stream_game_length = event.game_time
+            result.append(self._segment_item('final', event, valid))
+            self.stream_game_loop = event.gameloop
 
             # Fulfill Early if not done
             if self.stream_segments['early'] is None:
-                item = StreamItem(event, state=self, payload=SegmentEvent(key='early', valid=False))
-                result.append(item)
-                self.stream_segments['early'] = item
+                result.append(self._segment_item('early', event, valid=False))
         return result
 
+    def _segment_item(self, key: str, event: Event, valid: bool) -> StreamItem:
+        """
+        Marks the segment as reached, both for the stream and in self.segments
+        like Replay does.
+        """
+        item = StreamItem(event, state=self, payload=SegmentEvent(key=key, valid=valid))
+        self.stream_segments[key] = item
+        self._take_segment(key, event)
+        self.segments[key]['valid'] = valid
+        return item
+
 
     @property
     def messages(self):
-        for m in self.message_events:
-            m = Event(m)
-            if not m['_event'] == 'NNet.Game.SChatMessage':
-                continue
-            recipient_id = m['m_recipient']
-            owner_id = m['_userid']['m_userId']
-            chat_type = "all_chat" if recipient_id == 0 else "allied_chat"
-            owner = self.get_player(owner_id, 'user_id')
-            if owner is None:
-                continue
-            payload = MessageEvent(
-                profile=owner,
-                game_time=m.game_time,
-                message_type=chat_type,
-                message=m['m_string']
-            )
-            yield payload
-
-
-    def _parse(self):
-        log.info(f"{self.game_id} - Parsing Game")
-
-        for event in self.tracker_events:
-            item = StreamItem(event)
-            init_event = self.tracked_units.fetch(event)
-
-            if event.unit_init or event.unit_born:
-                self.tracked_units.add(event)
-                item.payload = self._parse_initialize_unit(event)
-
-
-            if event.unit_owner_transferred:
-                self._parse_transferred(event)
+        for m in self.chat_messages:
+            payload = self._message_event(m)
+            if payload is not None:
+                yield payload
+
+    def _message_event(self, m) -> typing.Optional[MessageEvent]:
+        recipient_id = m['m_recipient']
+        owner_id = m['_userid']['m_userId']
+        chat_type = "all_chat" if recipient_id == 0 else "allied_chat"
+        owner = self.get_player(owner_id, 'user_id')
+        if owner is None:
+            return
+        return MessageEvent(
+            profile=owner,
+            gameloop=m.gameloop,
+            message_type=chat_type,
+            message=m['m_string']
+        )
 
-            if event.stats_update:
-                item.payload = self._parse_stats_update(event)
 
-            if event.upgrade_event:
-                item.payload = self._parse_upgrade(event)
+    def track_timeline(self, interval: int = DEFAULT_CHECKPOINT_INTERVAL) -> Timeline:
+        """
+        Keeps player state checkpoints while parsing so state_at() can answer
+        for any game loop afterwards. Call before parsing.
+        """
+        self.timeline = Timeline([p.snapshot() for p in self.players], interval=interval)
+        self._timeline_recorder = TimelineRecorder(self.timeline, self.players)
+        return self.timeline
 
-            if event.unit_died and init_event is not None:
-                item.payload = self._parse_unit_died(event, init_event)
+    def _touch(self, player: Player):
+        """
+        Tells the timeline that the stat event, upgrades or elimination of
+        player changed. Count changes reach it through the Stats journal.
+        """
+        if self._timeline_recorder is not None:
+            self._timeline_recorder.touched.add(player)
 
-            self._parse_check_for_segments(event)
+    def state_at(self, gameloop: int) -> typing.Tuple[PlayerState, ...]:
+        """
+        Every player's state as of gameloop, in the order of self.players.
+        Needs track_timeline() before parsing.
+        Parameters
+        ----------
+        gameloop: Game loop to look up. Events on that loop are included.
 
+        Returns
+        -------
+        Tuple[PlayerState]
+        """
+        if self.timeline is None:
+            raise ValueError("No timeline was tracked. Call track_timeline() before parsing.")
+        if self.partial and gameloop > self.parsed_game_loop:
+            raise ValueError(f"Parsing stopped at loop {self.parsed_game_loop}. No state for {gameloop}.")
+        return self.timeline.state_at(gameloop)
+
+    def parse_until(self, segment: typing.Optional[str] = None, gameloop: typing.Optional[int] = None,
+                    predicate: typing.Optional[typing.Callable[[StreamItem], bool]] = None) -> typing.Iterator[StreamItem]:
+        """
+        Same as _parse, but stops early. Decoding stops there too, and partial,
+        stopped_at_loop and pending_segments say how far it got. Everything
+        produced for the event a stop was triggered by is still yielded, like
+        an 'early' segment taken together with 'final'.
+        Parameters
+        ----------
+        segment: Stop once this segment has been yielded, e.g 'early'
+        gameloop: Stop before handling any tracker event past this loop
+        predicate: Stop once an item it returns True for has been yielded
 
-            item.state = self
-            if isinstance(item.payload, list):
-                for i in item.payload:
-                    yield StreamItem(item.event, payload=i, state=self)
-            else:
+        Returns
+        -------
+        Iterator[StreamItem]
+        """
+        self.stopped_at_loop = None
+        batches = self._parse_events(until_loop=gameloop)
+        for batch in batches:
+            stop = False
+            for item in batch:
                 yield item
+                if segment is not None and isinstance(item.payload, SegmentEvent) and item.payload.key == segment:
+                    stop = True
+                if predicate is not None and predicate(item):
+                    stop = True
+            if stop:
+                break
+        else:
+            return
+        batches.close()
+        self.stopped_at_loop = self.parsed_game_loop
 
-            # We check this last as it could yield a duplicate event per the above.
-            segment_stream_items = self._stream_segments(item)
-            for ssi in segment_stream_items:
-                yield ssi
+    def summarize(self) -> typing.Iterator[StreamItem]:
+        """
+        Parses only until the final segment has fired. By then every player has
+        been eliminated or declared a winner, so the rosters, results and game
+        length are complete; only what happens after the game is decided is
+        left out.
+        """
+        return self.parse_until(segment='final')
 
+    def _parse(self, until_loop: typing.Optional[int] = None):
+        """
+        Handles the tracker events in order and yields a StreamItem for every
+        payload a handler returns, or an empty one if there were none, followed
+        by any segments reached. Segments are also kept in self.segments, as
+        Replay keeps them. Chat messages are merged in by game loop and
+        yielded with a MessageEvent payload.
+        Parameters
+        ----------
+        until_loop: Stop before the first event past this loop. See parse_until
+        """
+        for batch in self._parse_events(until_loop=until_loop):
+            yield from batch
 
+    def _parse_events(self, until_loop: typing.Optional[int] = None) -> typing.Iterator[typing.List[StreamItem]]:
+        """
+        _parse, one list of StreamItems per event handled. The next event is
+        only handled once the caller asks for the next list.
+        """
+        log.info(f"{self.game_id} - Parsing Game")
+        handlers = self._handlers
 
+        for event in self.merged_events(self.handled_tracker_events):
+            if until_loop is not None and event.gameloop > until_loop:
+                self.stopped_at_loop = self.parsed_game_loop
+                return
+            self.parsed_game_loop = event.gameloop
+
+            item = StreamItem(event, state=self)
+            event_handlers = handlers.get(event.kind)
+            if event.kind == CHAT_MESSAGE:
+                message = self._message_event(event)
+                batch = [] if message is None else [StreamItem(event, payload=message, state=self)]
+            elif event_handlers is None:
+                # Only here if the stream could not be filtered. Nothing to
+                # handle, but it still counts for the early segment below.
+                batch = []
+            else:
+                payloads = []
+                for handler in event_handlers:
+                    payload = handler(event)
+                    if isinstance(payload, list):
+                        payloads.extend(payload)
+                    elif payload is not None:
+                        payloads.append(payload)
+
+                if payloads:
+                    batch = [StreamItem(event, payload=payload, state=self) for payload in payloads]
+                else:
+                    batch = [item]
 
+                if self._timeline_recorder is not None:
+                    self._timeline_recorder.record(event.gameloop)
 
+            # Segment boundaries are checked on every event, whatever its kind.
+            # We check this last as it could yield a duplicate event per the above.
+            batch.extend(self._stream_segments(item))
+            if batch:
+                yield batch
@@ -0,0 +1,169 @@
+import logging
+import typing
+
+from .objects import Event
+
+log = logging.getLogger(__name__)
+
+
+# MPQ file name -> s2protocol decoder function for every event stream we read.
+STREAM_DECODERS = {
+    'replay.tracker.events': 'decode_replay_tracker_events',
+    'replay.game.events': 'decode_replay_game_events',
+    'replay.message.events': 'decode_replay_message_events',
+}
+
+
+def tracker_event_ids(protocol, names: typing.Iterable[str]) -> typing.Optional[typing.Set[int]]:
+    """
+    Resolves tracker event type names to the event ids of this protocol build.
+    Returns None if the protocol doesn't publish its event table.
+    """
+    event_types = getattr(protocol, 'tracker_event_types', None)
+    if event_types is None:
+        return None
+    names = set(names)
+    return {event_id for event_id, (_, name) in event_types.items() if name in names}
+
+
+def decode_tracker_events(protocol, contents: bytes, wanted_ids: typing.Optional[typing.Set[int]] = None) -> typing.Iterator[dict]:
+    """
+    Same as protocol.decode_replay_tracker_events, except events whose id isn't
+    in wanted_ids are skipped over in the bitstream without being built. Unit
+    position events in particular are frequent and large and we never read
+    them.
+
+    The tracker stream is version encoded, so every event carries enough
+    framing to be skipped without knowing its type.
+    Parameters
+    ----------
+    protocol: s2protocol protocol module for the replay build
+    contents: raw replay.tracker.events
+    wanted_ids: event ids to decode. None decodes everything.
+
+    Returns
+    -------
+    Iterator[dict] of decoded events, as s2protocol would yield them.
+    """
+    if wanted_ids is None:
+        yield from protocol.decode_replay_tracker_events(contents)
+        return
+
+    try:
+        decoder = protocol.VersionedDecoder(contents, protocol.typeinfos)
+        eventid_typeid = protocol.tracker_eventid_typeid
+        event_types = protocol.tracker_event_types
+        gameloop_typeid = protocol.svaruint32_typeid
+        varuint32_value = protocol._varuint32_value
+    except AttributeError:
+        # Not laid out like the protocol modules we know. Still drop the events
+        # before anything else gets built from them.
+        log.debug(f"{protocol.__name__} can't skip tracker events. Filtering after decode.")
+        for event in protocol.decode_replay_tracker_events(contents):
+            if event['_eventid'] in wanted_ids:
+                yield event
+        return
+
+    gameloop = 0
+    while not decoder.done():
+        gameloop += varuint32_value(decoder.instance(gameloop_typeid))
+        event_id = decoder.instance(eventid_typeid)
+        if event_id in wanted_ids:
+            typeid, typename = event_types[event_id]
+            event = decoder.instance(typeid)
+            event['_event'] = typename
+            event['_eventid'] = event_id
+            event['_gameloop'] = gameloop
+            decoder.byte_align()
+            yield event
+        else:
+            if event_id not in event_types:
+                raise protocol.CorruptedError('eventid({}) at {}'.format(event_id, decoder))
+            decoder._skip_instance()
+            decoder.byte_align()
+
+
+def decode_stream(archive, name: str, protocol, wanted_ids: typing.Optional[typing.Set[int]] = None) -> typing.Iterator[dict]:
+    """
+    The raw s2protocol events of one stream of the archive.
+    Parameters
+    ----------
+    archive: mpyq.MPQArchive of the replay
+    name: MPQ file name of the stream
+    protocol: s2protocol protocol module to decode with
+    wanted_ids: Tracker streams only. Only decode events with these ids.
+    """
+    contents = archive.read_file(name)
+    if wanted_ids is not None and name == 'replay.tracker.events':
+        return decode_tracker_events(protocol, contents, wanted_ids)
+    return getattr(protocol, STREAM_DECODERS[name])(contents)
+
+
+class DecodedStream:
+    """
+    Decodes an event stream of the replay archive lazily, as far as its
+    readers go.
+
+    By default nothing is buffered. Events go straight to the first reader and
+    are gone once it lets go of them, so memory stays flat however long the
+    replay is. Nobody else can read the stream after that.
+
+    With retain=True the decoded events are shared with every reader. Events
+    are pulled from s2protocol only as far as the furthest reader has gone,
+    and anyone iterating later replays the buffered events and continues
+    decoding from where the last reader stopped. Only meant for streams that
+    are read a short way from the start by several readers (like the player
+    setup lookup at the start of the tracker events), where the buffer never
+    holds more than that prefix.
+    """
+
+    def __init__(self, events: typing.Iterator[dict], protocol=None, retain: bool = False):
+        self.protocol = protocol
+        self.retain = retain
+        self._source = events
+        self._buffer: typing.List[Event] = []
+
+    @classmethod
+    def from_archive(cls, archive, name: str, protocol, wanted_ids: typing.Optional[typing.Set[int]] = None,
+                     retain: bool = False) -> 'DecodedStream':
+        """
+        Parameters
+        ----------
+        archive: mpyq.MPQArchive of the replay
+        name: MPQ file name of the stream
+        protocol: s2protocol protocol module to decode with
+        wanted_ids: Tracker streams only. Only decode events with these ids.
+        retain: Buffer the events for later readers
+        """
+        events = (Event(e) for e in decode_stream(archive, name, protocol, wanted_ids))
+        return cls(events, protocol=protocol, retain=retain)
+
+    @property
+    def exhausted(self) -> bool:
+        return self._source is None
+
+    def _pull(self) -> bool:
+        """Decodes the next event into the buffer. False once the stream has ended."""
+        if self._source is None:
+            return False
+        try:
+            self._buffer.append(next(self._source))
+        except StopIteration:
+            self._source = None
+            return False
+        return True
+
+    def __iter__(self) -> typing.Iterator[Event]:
+        if not self.retain:
+            source, self._source = self._source, None
+            if source is not None:
+                yield from source
+            return
+        buffer = self._buffer
+        index = 0
+        while True:
+            if index < len(buffer):
+                yield buffer[index]
+                index += 1
+            elif not self._pull():
+                return
@@ -0,0 +1,193 @@
+"""
+Player state at any point of a game without parsing it again.
+
+While a StreamParser runs, a Timeline takes a checkpoint of every player's
+PlayerState every interval game loops. In between it only logs what changed
+for the players an event touched: a new stat event or upgrade totals, the
+unit count changes and elimination. Looking up a game loop bisects to the
+checkpoint before it and applies the changes logged since, so the cost is
+O(log n + changes in one interval).
+
+TimelineRecorder feeds it from the live players while parsing and is not
+kept with it, so a Timeline pickles along with a ParseResult.
+"""
+import bisect
+import typing
+
+from .objects import PlayerState, UnitCounts, UNIT_CATEGORIES
+from . import utils
+
+# 30 game seconds
+DEFAULT_CHECKPOINT_INTERVAL = utils.seconds_to_gameloop(30)
+
+# PlayerState fields elimination changes, in the order PlayerDelta.status has them
+STATUS_FIELDS = ('left_game', 'eliminated', 'winner', 'victim_number', 'eliminated_at_loop', 'killer_id', 'killer_name')
+
+
+class Checkpoint(typing.NamedTuple):
+    gameloop: int
+    players: typing.Tuple[PlayerState, ...]
+    # Number of deltas logged before it. They are all included in players.
+    delta_index: int
+
+
+class PlayerDelta(typing.NamedTuple):
+    """What one event changed for one player. None or empty where nothing did."""
+    stat_event: typing.Optional[typing.Mapping[str, typing.Any]]
+    upgrade_totals: typing.Optional[typing.Mapping[str, int]]
+    # (unit, index in UNIT_CATEGORIES, change)
+    counts: typing.Tuple[typing.Tuple[str, int, int], ...]
+    # Values of STATUS_FIELDS
+    status: typing.Optional[tuple]
+
+
+class Timeline:
+    """
+    Parameters
+    ----------
+    players: Every player's state at the start of the game
+    interval: Game loops between checkpoints
+    """
+
+    def __init__(self, players: typing.Sequence[PlayerState], interval: int = DEFAULT_CHECKPOINT_INTERVAL):
+        if interval <= 0:
+            raise ValueError("Checkpoint interval must be positive")
+        self.interval = interval
+        # The first checkpoint is from before any event, including those on loop 0
+        self.checkpoints: typing.List[Checkpoint] = [Checkpoint(-1, tuple(players), 0)]
+        self._checkpoint_loops = [-1]
+        # Parallel lists. _deltas[i] is (player index, PlayerDelta) at _delta_loops[i]
+        self._delta_loops: typing.List[int] = []
+        self._deltas: typing.List[typing.Tuple[int, PlayerDelta]] = []
+        self.last_gameloop = 0
+
+    def checkpoint_due(self, gameloop: int) -> bool:
+        return gameloop >= (self._checkpoint_loops[-1] // self.interval + 1) * self.interval
+
+    def add_checkpoint(self, gameloop: int, players: typing.Sequence[PlayerState]):
+        """
+        Every player's state after the latest event, which is on gameloop.
+        Events must be recorded in game loop order.
+        """
+        self.checkpoints.append(Checkpoint(gameloop, tuple(players), len(self._deltas)))
+        self._checkpoint_loops.append(gameloop)
+        self.last_gameloop = gameloop
+
+    def add_delta(self, gameloop: int, player_index: int, delta: PlayerDelta):
+        self._delta_loops.append(gameloop)
+        self._deltas.append((player_index, delta))
+        self.last_gameloop = gameloop
+
+    def state_at(self, gameloop: int) -> typing.Tuple[PlayerState, ...]:
+        """
+        Every player's state after all events up to and including gameloop.
+        """
+        index = bisect.bisect_right(self._checkpoint_loops, gameloop) - 1
+        checkpoint = self.checkpoints[max(index, 0)]
+        if gameloop < 0:
+            return checkpoint.players
+        end = bisect.bisect_right(self._delta_loops, gameloop)
+        if end <= checkpoint.delta_index:
+            return checkpoint.players
+        return apply_deltas(checkpoint.players, self._deltas[checkpoint.delta_index:end])
+
+
+def apply_deltas(players: typing.Sequence[PlayerState],
+                 deltas: typing.Iterable[typing.Tuple[int, PlayerDelta]]) -> typing.Tuple[PlayerState, ...]:
+    """The player states after the deltas, in order. Only changed players are rebuilt."""
+    changes: typing.Dict[int, typing.Dict[str, typing.Any]] = {}
+    for index, delta in deltas:
+        change = changes.setdefault(index, {})
+        if delta.stat_event is not None:
+            change['stat_event'] = delta.stat_event
+        if delta.upgrade_totals is not None:
+            change['upgrade_totals'] = delta.upgrade_totals
+        if delta.status is not None:
+            change.update(zip(STATUS_FIELDS, delta.status))
+        if delta.counts:
+            counts = change.get('unit_counts')
+            if counts is None:
+                counts = change['unit_counts'] = {u: list(c) for u, c in players[index].unit_counts.items()}
+            for unit, category, n in delta.counts:
+                unit_counts = counts.get(unit)
+                if unit_counts is None:
+                    unit_counts = counts[unit] = [0] * len(UNIT_CATEGORIES)
+                unit_counts[category] += n
+
+    players = list(players)
+    for index, change in changes.items():
+        counts = change.get('unit_counts')
+        if counts is not None:
+            change['unit_counts'] = {u: UnitCounts(*c) for u, c in counts.items()}
+        players[index] = players[index]._replace(**change)
+    return tuple(players)
+
+
+def _status(player) -> tuple:
+    killer = player.killer
+    return (
+        player.left_game, player.eliminated, player.winner, player.victim_number, player.eliminated_at_loop,
+        None if killer is None else killer.profile_id, None if killer is None else killer.name,
+    )
+
+
+class TimelineRecorder:
+    """
+    Records the changes of the live players into a Timeline after every event.
+
+    The players' Stats log each count change into journal, and the parser adds
+    the players whose stat event, upgrades or elimination it changed to
+    touched. Only those players are looked at, and everyone is only
+    snapshotted when a checkpoint is due.
+    Parameters
+    ----------
+    timeline: Timeline to record into
+    players: The live Players, in the order of the timeline
+    """
+
+    def __init__(self, timeline: Timeline, players: typing.Sequence[typing.Any]):
+        self.timeline = timeline
+        self.players = tuple(players)
+        self._index = {p: i for i, p in enumerate(self.players)}
+        # (player, unit, category index, change), shared by every player's Stats
+        self.journal: typing.List[typing.Tuple[typing.Any, str, int, int]] = []
+        self.touched: typing.Set[typing.Any] = set()
+        for p in self.players:
+            p.unit_stats.journal = self.journal
+        self._last = {p: self._recorded(p) for p in self.players}
+
+    @staticmethod
+    def _recorded(player) -> tuple:
+        return player.unit_stats.stat_event, player.upgrade_totals, _status(player)
+
+    def record(self, gameloop: int):
+        """Call after each event is handled, in game loop order."""
+        if self.timeline.checkpoint_due(gameloop):
+            self.timeline.add_checkpoint(gameloop, [p.snapshot() for p in self.players])
+            self.journal.clear()
+            self.touched.clear()
+            self._last = {p: self._recorded(p) for p in self.players}
+            return
+        if not self.journal and not self.touched:
+            return
+
+        counts: typing.Dict[typing.Any, typing.List[typing.Tuple[str, int, int]]] = {}
+        for player, unit, category, n in self.journal:
+            counts.setdefault(player, []).append((unit, category, n))
+        self.journal.clear()
+        touched = self.touched.union(counts)
+        self.touched.clear()
+
+        for index, player in sorted((self._index[p], p) for p in touched if p in self._index):
+            stat_event, upgrade_totals, status = self._last[player]
+            now = self._recorded(player)
+            delta = PlayerDelta(
+                stat_event=None if now[0] is stat_event else now[0],
+                upgrade_totals=None if now[1] is upgrade_totals else now[1],
+                counts=tuple(counts.get(player, ())),
+                status=None if now[2] == status else now[2],
+            )
+            if delta.stat_event is None and delta.upgrade_totals is None and not delta.counts and delta.status is None:
+                continue
+            self.timeline.add_delta(gameloop, index, delta)
+            self._last[player] = now
@@ -1,3 +1,39 @@
+import functools
+from decimal import Decimal
+
+
+# The trigger clock runs 16 game loops per game second and ZC is played on the
+# "Faster" game speed (x1.4). Game loops are the canonical time unit inside
+# zclreplay; seconds are only produced when something is serialized.
+GAMELOOPS_PER_SECOND = 16
+GAME_SPEED = Decimal("1.4")
+
+
+def seconds_to_gameloop(seconds: float) -> int:
+    """The last game loop that is still at or before the given game time."""
+    return int(Decimal(str(seconds)) * GAMELOOPS_PER_SECOND * GAME_SPEED)
+
+
+# Game time the "early" segment is taken at (8m).
+EARLY_SEGMENT_GAMELOOP = seconds_to_gameloop(480)
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def game_time(gameloop: int) -> str:
+    """
+    Converts a game loop to game seconds, rounded to 4 places. This is the
+    string format game times have always been stored in. Loops repeat a lot
+    (every player row of a chart shares one) so the conversion is cached.
+    """
+    seconds = Decimal(gameloop) / Decimal(GAMELOOPS_PER_SECOND)
+    seconds = seconds / GAME_SPEED
+    return str(round(seconds, 4))
+
+
+def gameloop_to_seconds(gameloop: int) -> float:
+    return float(game_time(gameloop))
+
+
 def zc_bunker_type(index: int) -> str:
     marine = [
         1,2,3,4,5,6,8,15,16,23,24,31,32,39,40,47,48,55,57,58,59,60,61,62